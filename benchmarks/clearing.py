@@ -0,0 +1,142 @@
+"""
+Property check and benchmark of the clearing engines.
+
+Clears random auctions, small and tie-heavy, with both engines and compares
+every bid's fill and payment with a brute-force reference solver that knows
+nothing of the order book: each bid's fill follows from the demand priced
+strictly above it and at its price, found by scanning every other bid.
+Supply and ether conservation are checked on every case. Then times both
+engines on a large book.
+
+    python benchmarks/clearing.py [cases] [--bids 100000]
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+from fractions import Fraction
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dapp"))
+
+from modules.clearing import ENGINES, PAY_AS_BID, UNIFORM
+from modules.models import Auction, Bid
+from modules.settlement import ETHER, SettlementPlan
+
+Bids = List[Tuple[str, int, int]]
+
+
+def reference(bids: Bids, supply: int, reserve_price_per_token: int, mode: str) -> Tuple[List[int], List[int], Optional[Fraction]]:
+    """Fill and payment of every bid, in arrival order, and the price per token, by brute force."""
+    prices = [Fraction(ether_amount, erc20_amount) for _, ether_amount, erc20_amount in bids]
+    fills = []
+    for i, price in enumerate(prices):
+        above = sum(bids[j][2] for j in range(len(bids)) if prices[j] > price)
+        tier = [j for j in range(len(bids)) if prices[j] == price]
+        demand = sum(bids[j][2] for j in tier)
+        available = max(supply - above, 0)
+        if demand <= available:
+            fills.append(bids[i][2])
+            continue
+        # pro rata over the tier, leftover units to the largest remainders, earliest bid first
+        shares = {j: available * bids[j][2] // demand for j in tier}
+        leftover = available - sum(shares.values())
+        by_remainder = sorted(tier, key=lambda j: (-(available * bids[j][2] % demand), j))
+        fills.append(shares[i] + (1 if i in by_remainder[:leftover] else 0))
+
+    winning = [price for price, fill in zip(prices, fills) if fill]
+    losing = [price for price, fill, (_, _, erc20_amount) in zip(prices, fills, bids) if fill < erc20_amount]
+    if mode == UNIFORM:
+        price = max(losing) if losing else (Fraction(reserve_price_per_token) if bids else None)
+        payments = [fill * price.numerator // price.denominator if fill else 0 for fill in fills]
+    else:
+        price = min(winning) if winning else None
+        payments = [ether_amount * fill // erc20_amount for (_, ether_amount, erc20_amount), fill in zip(bids, fills)]
+    return fills, payments, price
+
+
+def random_case(rng: random.Random) -> Tuple[Bids, int, int]:
+    reserve_price_per_token = rng.randint(1, 5)
+    # few distinct prices and quantities, so ties at the marginal price are common
+    bids = []
+    for _ in range(rng.randint(0, 30)):
+        erc20_amount = rng.choice([1, 2, 3, 5, 8, rng.randint(1, 50)])
+        ether_amount = erc20_amount * rng.randint(reserve_price_per_token, reserve_price_per_token + 4) + rng.choice([0, 0, 0, rng.randint(0, erc20_amount)])
+        bids.append((f"0x{rng.randint(0, 7):040x}", ether_amount, erc20_amount))
+    supply = rng.randint(1, max(1, sum(erc20_amount for _, _, erc20_amount in bids) + 5))
+    return bids, supply, reserve_price_per_token
+
+
+def cleared(bids: Bids, supply: int, reserve_price_per_token: int, mode: str):
+    Auction.clearing_engine = ENGINES[mode]
+    auction = Auction(sender="0xseller", duration=1, amount=supply, token_address="0xtoken", reserve_price_per_token=reserve_price_per_token, timestamp=0)
+    for sender, ether_amount, erc20_amount in bids:
+        auction.add_bid(Bid(ether_amount, sender, erc20_amount))
+    return auction, auction.clearing()
+
+
+def check(bids: Bids, supply: int, reserve_price_per_token: int, mode: str) -> None:
+    auction, clearing = cleared(bids, supply, reserve_price_per_token, mode)
+    fills, payments, price = reference(bids, supply, reserve_price_per_token, mode)
+    context = f"{mode} supply {supply} reserve {reserve_price_per_token} bids {bids}"
+    assert clearing.price == price, f"price {clearing.price} != {price}: {context}"
+    assert clearing.sold == sum(fills), f"sold {clearing.sold} != {sum(fills)}: {context}"
+    assert clearing.proceeds == sum(payments), f"proceeds {clearing.proceeds} != {sum(payments)}: {context}"
+    assert clearing.winners == sum(1 for fill in fills if fill), f"winners: {context}"
+
+    transfers: Dict[str, int] = {}
+    refunds: Dict[str, int] = {}
+    for (sender, ether_amount, _), fill, payment in zip(bids, fills, payments):
+        assert 0 <= payment <= ether_amount
+        if fill:
+            transfers[sender] = transfers.get(sender, 0) + fill
+        if ether_amount - payment:
+            refunds[sender] = refunds.get(sender, 0) + ether_amount - payment
+    plan = SettlementPlan()
+    auction.finish(1, plan)
+    finished_transfers = plan.owed("0xtoken")
+    finished_refunds = plan.owed(ETHER)
+    remaining = finished_transfers.pop("0xseller", 0)
+    proceeds = finished_refunds.pop("0xseller", 0)
+    assert finished_transfers == transfers, f"transfers: {context}"
+    assert finished_refunds == refunds, f"refunds: {context}"
+    assert proceeds == sum(payments), f"seller paid {proceeds}, not {sum(payments)}: {context}"
+    assert sum(transfers.values()) + remaining == supply, f"tokens not conserved: {context}"
+    assert proceeds + sum(refunds.values()) == sum(ether_amount for _, ether_amount, _ in bids), f"ether not conserved: {context}"
+
+
+def timed(bids: Bids, supply: int, mode: str) -> Tuple[float, float]:
+    start = time.perf_counter()
+    auction, _ = cleared(bids, supply, 1, mode)
+    placed = time.perf_counter()
+    auction.finish(1, SettlementPlan())
+    return placed - start, time.perf_counter() - placed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("cases", nargs="?", type=int, default=2000, help="random auctions to check per engine")
+    parser.add_argument("--bids", type=int, default=100000, help="bids in the timed auction")
+    parser.add_argument("--seed", type=int, default=5)
+    parser.add_argument("--log-level", default="WARNING", help="level of the dApp logs")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(args.log_level)
+
+    rng = random.Random(args.seed)
+    for _ in range(args.cases):
+        case = random_case(rng)
+        for mode in (PAY_AS_BID, UNIFORM):
+            check(*case, mode)
+    print(f"{args.cases} random auctions match the reference solver with both engines")
+
+    bids = [(f"0x{i:040x}", erc20_amount * rng.randint(10**12, 3 * 10**12), erc20_amount) for i, erc20_amount in ((i, rng.randint(1, 1000)) for i in range(args.bids))]
+    supply = sum(erc20_amount for _, _, erc20_amount in bids) // 3
+    for mode in (PAY_AS_BID, UNIFORM):
+        place, finish = timed(bids, supply, mode)
+        print(f"{mode:<12} {args.bids} bids placed in {place * 1e3:8.1f} ms, cleared and settled in {finish * 1e3:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Micro-benchmark of the portal payload decoders.
+
+Compares the fixed-layout memoryview parsers in modules.inputs with the
+previous path that sliced bytes and ran the packed eth_abi codec.
+
+    python benchmarks/decoders.py [iterations]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dapp"))
+
+from modules.eth_abi_ext import decode_packed
+from modules.convertions import Convertions as convert
+from modules.function_selectors import SELECTORS, NEW_AUCTION, NEW_BID, NEW_BID_BY_ID
+from modules.inputs import parse_erc20_deposit, parse_ether_deposit
+
+ADDRESS = bytes.fromhex("f39fd6e51aad88f6f4ce6ab8827279cfffb92266")
+TOKEN = bytes.fromhex("5fbdb2315678afecb367f032d93f642f64180aa3")
+
+ERC20_PAYLOAD = b"\x01" + TOKEN + ADDRESS + (10**21).to_bytes(32, "big") + SELECTORS[NEW_AUCTION] + ADDRESS + (3600).to_bytes(32, "big") + (10**15).to_bytes(32, "big")
+ETHER_PAYLOAD = ADDRESS + (10**18).to_bytes(32, "big") + SELECTORS[NEW_BID] + ADDRESS + (10**20).to_bytes(32, "big")
+ETHER_BY_ID_PAYLOAD = ADDRESS + (10**18).to_bytes(32, "big") + SELECTORS[NEW_BID_BY_ID] + ADDRESS + (7).to_bytes(32, "big") + (10**20).to_bytes(32, "big")
+
+
+def codec_erc20_deposit(binary):
+    token_address = binary[1:21]
+    depositor = binary[21:41]
+    amount = int.from_bytes(binary[41:73], "big")
+    function_signature = binary[73:77]
+    data = decode_packed(['address', 'uint256', 'uint256'], binary[77:])
+    return {
+        "depositor": convert.binary2hex(depositor),
+        "token_address": convert.binary2hex(token_address),
+        "amount": amount,
+        "function_signature": convert.binary2hex(function_signature),
+        "sender": data[0],
+        "duration": data[1],
+        "reserve_price_per_token": data[2]
+    }
+
+
+def codec_ether_deposit(binary):
+    depositor = binary[:20]
+    amount = int.from_bytes(binary[20:52], "big")
+    function_signature = binary[52:56]
+    if function_signature == SELECTORS[NEW_BID_BY_ID]:
+        sender, auction_id, erc20_interested_amount = decode_packed(['address', 'uint256', 'uint256'], binary[56:])
+    else:
+        (sender, erc20_interested_amount), auction_id = decode_packed(['address', 'uint256'], binary[56:]), None
+    return {
+        "depositor": convert.binary2hex(depositor),
+        "amount": amount,
+        "function_signature": convert.binary2hex(function_signature),
+        "sender": sender,
+        "erc20_interested_amount": erc20_interested_amount,
+        "auction_id": auction_id
+    }
+
+
+def check():
+    for codec, fixed, payload in [(codec_erc20_deposit, parse_erc20_deposit, ERC20_PAYLOAD), (codec_ether_deposit, parse_ether_deposit, ETHER_PAYLOAD), (codec_ether_deposit, parse_ether_deposit, ETHER_BY_ID_PAYLOAD)]:
+        assert codec(payload) == fixed(payload)._asdict(), f"{fixed.__name__} disagrees with the codec path"
+
+
+def main(iterations: int) -> None:
+    check()
+    cases = [
+        ("erc20 deposit", codec_erc20_deposit, parse_erc20_deposit, ERC20_PAYLOAD),
+        ("ether deposit", codec_ether_deposit, parse_ether_deposit, ETHER_PAYLOAD),
+        ("ether by id", codec_ether_deposit, parse_ether_deposit, ETHER_BY_ID_PAYLOAD),
+    ]
+    print(f"{'payload':<16}{'eth_abi codec':>16}{'fixed layout':>16}{'speedup':>10}")
+    for name, codec, fixed, payload in cases:
+        codec_time = min(timeit.repeat(lambda: codec(payload), number=iterations, repeat=5)) / iterations
+        fixed_time = min(timeit.repeat(lambda: fixed(payload), number=iterations, repeat=5)) / iterations
+        print(f"{name:<16}{codec_time * 1e6:>13.2f} us{fixed_time * 1e6:>13.2f} us{codec_time / fixed_time:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
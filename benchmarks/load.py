@@ -0,0 +1,336 @@
+"""
+Load generator for the advance and inspect handlers.
+
+Runs scripted scenarios against a fresh copy of dapp/auction.py without a
+Cartesi node. Outputs go to a local stand-in rollup server (or are dropped
+with --sink null) and, per kind of input, the harness reports inputs per
+second and p50/p99/max latency. The status and the vouchers of every input
+are checked against what its kind should get back, and any mismatch fails
+the run. --memory adds the peak traced allocation
+per input and the memory retained once the scenario is over.
+
+By default the handlers are called in-process and the latency covers the
+handler and posting its outputs. --end-to-end runs the dApp's own main loop
+against the stub instead, so the latency is measured between /finish calls.
+
+--record writes the requests of the scenarios to a JSONL log that
+benchmarks/replay.py can re-execute.
+
+    python benchmarks/load.py [scenario ...] [--sink null] [--memory] [--end-to-end] [--record PATH]
+"""
+import argparse
+import importlib.util
+import itertools
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Dict, Iterator, List, Tuple
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+DAPP = os.path.join(BENCHMARKS, "..", "dapp")
+sys.path.insert(0, DAPP)
+
+from modules.outputs import Base, BasePipeline
+from payloads import address, erc20_deposit, ether_deposit, finish_auction, advance, inspect
+from rollup_stub import RollupStub
+
+NETWORK = os.environ.get("NETWORK", "sepolia")
+NETWORKS = json.load(open(os.path.join(DAPP, "networks.json")))[NETWORK]
+RELAY = NETWORKS["DAPP_RELAY_ADDRESS"]
+ETHER_PORTAL = NETWORKS["ETHER_PORTAL_ADDRESS"]
+ERC20_PORTAL = NETWORKS["ERC20_PORTAL_ADDRESS"]
+FOREST_RESERVE = NETWORKS["FOREST_RESERVE_ADDRESS"]
+UNKNOWN_SENDER = "0x" + "77" * 20
+
+DAPP_ADDRESS = address(0xda99)
+SELLER = address(0x5e11e4)
+TOKEN = address(0x70c3e)
+START = 1_700_000_000
+DURATION = 3600
+RESERVE_PRICE_PER_TOKEN = 10**12
+INSPECT_EVERY = 100
+
+Script = Iterator[Tuple[str, dict]]
+
+# status and number of vouchers every input of a label must get back
+EXPECTED = {
+    "new bid": ("accept", 0),
+    "rejected bid": ("reject", 0),
+    # direct inputs are no authenticated deposits, nothing may be paid out for them
+    "unknown sender": ("reject", 0),
+}
+
+
+class NullPipeline(BasePipeline):
+    """Output pipeline that drops every output, to time the handlers alone."""
+
+    def __init__(self) -> None:
+        super().__init__(None)
+
+    def enqueue(self, endpoint: str, json_data: dict) -> None:
+        pass
+
+    def flush(self) -> int:
+        return 0
+
+
+class CountingPipeline(BasePipeline):
+    """Passes every output on to pipeline, counting the vouchers."""
+
+    def __init__(self, pipeline: BasePipeline) -> None:
+        super().__init__(pipeline.rollup_server)
+        self.pipeline = pipeline
+        self.vouchers = 0
+
+    def enqueue(self, endpoint: str, json_data: dict) -> None:
+        if endpoint == "voucher":
+            self.vouchers += 1
+        self.pipeline.enqueue(endpoint, json_data)
+
+    def flush(self) -> int:
+        return self.pipeline.flush()
+
+
+def _bidder(i: int) -> bytes:
+    return address(0x10000 + i)
+
+
+def _bid(rng: random.Random) -> Tuple[int, int]:
+    erc20_amount = rng.randint(1, 1000)
+    return erc20_amount * rng.randint(RESERVE_PRICE_PER_TOKEN, 3 * RESERVE_PRICE_PER_TOKEN), erc20_amount
+
+
+def _inspects(i: int, auction_id: int) -> Script:
+    if i % INSPECT_EVERY == 0:
+        yield "inspect status", inspect("status")
+        yield "inspect clearing", inspect(f"clearing {auction_id}")
+        yield "inspect auctions", inspect("auctions")
+        # frontends poll the same JSON queries repeatedly between advances
+        for _ in range(2):
+            yield "inspect top_bids", inspect(json.dumps({"query": "top_bids", "auction_id": auction_id, "n": 10}))
+
+
+def single_auction(bids: int, supply: int, seed: int = 7) -> Script:
+    """One auction, bids bids placed on it, then an explicit finish."""
+    rng = random.Random(seed)
+    index = itertools.count()
+    yield "relay", advance(RELAY, DAPP_ADDRESS, START, next(index))
+    yield "new auction", advance(ERC20_PORTAL, erc20_deposit(TOKEN, SELLER, supply, DURATION, RESERVE_PRICE_PER_TOKEN), START, next(index))
+    for i in range(bids):
+        ether_amount, erc20_amount = _bid(rng)
+        yield "new bid", advance(ETHER_PORTAL, ether_deposit(_bidder(i), ether_amount, erc20_amount), START + 1 + i * (DURATION - 1) // bids, next(index))
+        yield from _inspects(i, auction_id=0)
+    yield "finish auction", advance(FOREST_RESERVE, finish_auction(), START + DURATION, next(index))
+
+
+def partial_fill(bids: int, seed: int = 11) -> Script:
+    """Supply for about a tenth of the demand: most bids end up refunded."""
+    return single_auction(bids, supply=bids * 50, seed=seed)
+
+
+def unknown_senders(deposits: int) -> Script:
+    """Deposits sent directly instead of through a portal, each rejected without a voucher."""
+    index = itertools.count()
+    yield "relay", advance(RELAY, DAPP_ADDRESS, START, next(index))
+    for i in range(deposits):
+        if i % 2:
+            payload = erc20_deposit(TOKEN, _bidder(i), 10**18, DURATION, RESERVE_PRICE_PER_TOKEN)
+        else:
+            payload = ether_deposit(_bidder(i), 10**18, 1)
+        yield "unknown sender", advance(UNKNOWN_SENDER, payload, START + i, next(index))
+
+
+def many_auctions(auctions: int, bids_per_auction: int, seed: int = 13) -> Script:
+    """Staggered auctions bid on by id and settled automatically at their deadline."""
+    rng = random.Random(seed)
+    index = itertools.count()
+    yield "relay", advance(RELAY, DAPP_ADDRESS, START, next(index))
+    for auction_id in range(auctions):
+        opened = START + auction_id * DURATION // 4
+        yield "new auction", advance(ERC20_PORTAL, erc20_deposit(TOKEN, SELLER, bids_per_auction * 250, DURATION, RESERVE_PRICE_PER_TOKEN), opened, next(index))
+        for i in range(bids_per_auction):
+            ether_amount, erc20_amount = _bid(rng)
+            yield "new bid", advance(ETHER_PORTAL, ether_deposit(_bidder(i), ether_amount, erc20_amount, auction_id=auction_id), opened + 1 + i, next(index))
+            yield from _inspects(auction_id * bids_per_auction + i, auction_id)
+    yield "settle expired", advance(RELAY, DAPP_ADDRESS, START + auctions * DURATION, next(index))
+
+
+def bid_flood(bids: int, seed: int = 17) -> Script:
+    """A few valid bids drowned in bids that fail validation: under the reserve, truncated or for a missing auction."""
+    rng = random.Random(seed)
+    index = itertools.count()
+    yield "relay", advance(RELAY, DAPP_ADDRESS, START, next(index))
+    yield "new auction", advance(ERC20_PORTAL, erc20_deposit(TOKEN, SELLER, bids * 25, DURATION, RESERVE_PRICE_PER_TOKEN), START, next(index))
+    for i in range(bids):
+        ether_amount, erc20_amount = _bid(rng)
+        timestamp = START + 1 + i * (DURATION - 1) // bids
+        kind = i % 10
+        if kind == 0:
+            yield "new bid", advance(ETHER_PORTAL, ether_deposit(_bidder(i), ether_amount, erc20_amount), timestamp, next(index))
+        elif kind < 6:
+            yield "rejected bid", advance(ETHER_PORTAL, ether_deposit(_bidder(i), erc20_amount, erc20_amount), timestamp, next(index))
+        elif kind < 8:
+            yield "rejected bid", advance(ETHER_PORTAL, ether_deposit(_bidder(i), ether_amount, erc20_amount)[:-1], timestamp, next(index))
+        else:
+            yield "rejected bid", advance(ETHER_PORTAL, ether_deposit(_bidder(i), ether_amount, erc20_amount, auction_id=9), timestamp, next(index))
+    yield "finish auction", advance(FOREST_RESERVE, finish_auction(), START + DURATION, next(index))
+
+
+SCENARIOS = {
+    "bids-1k": lambda: single_auction(1_000, supply=250_000),
+    "bids-10k": lambda: single_auction(10_000, supply=2_500_000),
+    "bids-100k": lambda: single_auction(100_000, supply=25_000_000),
+    "partial-fill": lambda: partial_fill(10_000),
+    "unknown-senders": lambda: unknown_senders(10_000),
+    "many-auctions": lambda: many_auctions(100, 100),
+    "bid-flood": lambda: bid_flood(10_000),
+}
+
+
+def recorded(script: Script, log) -> Script:
+    """Passes the script through, writing each request to log as the dApp's RECORD_PATH does."""
+    for label, request in script:
+        log.write(json.dumps(request, separators=(",", ":")) + "\n")
+        yield label, request
+
+
+def load_dapp(rollup_server: str):
+    """Imports a fresh copy of dapp/auction.py, so every scenario starts from an empty state."""
+    os.environ.setdefault("NETWORK", NETWORK)
+    os.environ["ROLLUP_HTTP_SERVER_URL"] = rollup_server
+    cwd = os.getcwd()
+    os.chdir(DAPP)
+    try:
+        spec = importlib.util.spec_from_file_location(f"auction_load_{time.monotonic_ns()}", os.path.join(DAPP, "auction.py"))
+        dapp = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(dapp)
+    finally:
+        os.chdir(cwd)
+    return dapp
+
+
+def check(label: str, status: str, vouchers: int, mismatches: Dict[str, int]) -> None:
+    expected = EXPECTED.get(label)
+    if expected is not None and expected != (status, vouchers):
+        mismatches[label] += 1
+
+
+def run_in_process(script: Script, stub: RollupStub, sink: str, memory: bool) -> Tuple[Dict[str, List[float]], Dict[str, int], Dict[str, int], Dict[str, int]]:
+    dapp = load_dapp(stub.url)
+    pipeline = CountingPipeline(NullPipeline() if sink == "null" else dapp.VOUCHER.pipeline)
+    Base.use_pipeline(pipeline)
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    peaks: Dict[str, int] = defaultdict(int)
+    statuses: Dict[str, int] = defaultdict(int)
+    mismatches: Dict[str, int] = defaultdict(int)
+
+    for label, request in script:
+        handler = dapp.handlers[request["request_type"]]
+        if memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        vouchers = pipeline.vouchers
+        start = time.perf_counter()
+        status = handler(request["data"])
+        pipeline.flush()
+        latencies[label].append(time.perf_counter() - start)
+        if memory:
+            peaks[label] = max(peaks[label], tracemalloc.get_traced_memory()[1] - before)
+        statuses[status] += 1
+        if request["request_type"] == "advance_state":
+            check(label, status, pipeline.vouchers - vouchers, mismatches)
+    return latencies, peaks, statuses, mismatches
+
+
+def run_end_to_end(script: Script, stub: RollupStub) -> Tuple[Dict[str, List[float]], Dict[str, int], Dict[str, int], Dict[str, int]]:
+    stub.latencies.clear()
+    stub.statuses.clear()
+    stub.vouchers.clear()
+    stub.load(script)
+    dapp = load_dapp(stub.url)
+    # the dApp loop never returns; it keeps polling /finish once the script is drained
+    threading.Thread(target=dapp.main, daemon=True).start()
+    stub.drained.wait()
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    for label, latency in stub.latencies:
+        latencies[label].append(latency)
+    statuses: Dict[str, int] = defaultdict(int)
+    mismatches: Dict[str, int] = defaultdict(int)
+    for (label, _), status, vouchers in zip(stub.latencies, stub.statuses, stub.vouchers):
+        statuses[status] += 1
+        check(label, status, vouchers, mismatches)
+    return latencies, {}, statuses, mismatches
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def report(name: str, elapsed: float, latencies: Dict[str, List[float]], peaks: Dict[str, int], statuses: Dict[str, int], outputs: Dict[str, int], mismatches: Dict[str, int]) -> None:
+    total = sum(len(values) for values in latencies.values())
+    print(f"\n{name}: {total} inputs in {elapsed:.2f}s, {total / elapsed:,.0f} inputs/s, statuses {dict(statuses)}, outputs {outputs}")
+    print(f"  {'input':<18}{'count':>8}{'inputs/s':>12}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}" + (f"{'peak KiB':>10}" if peaks else ""))
+    for label, values in latencies.items():
+        ordered = sorted(values)
+        line = f"  {label:<18}{len(values):>8}{len(values) / sum(values):>12,.0f}{_percentile(ordered, 0.5) * 1e3:>10.3f}{_percentile(ordered, 0.99) * 1e3:>10.3f}{ordered[-1] * 1e3:>10.3f}"
+        if peaks:
+            line += f"{peaks[label] / 1024:>10.1f}"
+        print(line)
+    for label, count in mismatches.items():
+        status, vouchers = EXPECTED[label]
+        print(f"  MISMATCH {count} {label} inputs did not get status {status} and {vouchers} vouchers")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("scenarios", nargs="*", default=["bids-1k", "partial-fill", "unknown-senders", "many-auctions"], help=f"any of {', '.join(SCENARIOS)}")
+    parser.add_argument("--sink", choices=["stub", "null"], default="stub", help="post outputs to the stand-in rollup server or drop them")
+    parser.add_argument("--memory", action="store_true", help="trace allocations (slows the handlers down)")
+    parser.add_argument("--end-to-end", action="store_true", help="drive the dApp main loop through /finish")
+    parser.add_argument("--log-level", default="WARNING", help="level of the dApp logs, INFO shows every input")
+    parser.add_argument("--record", metavar="PATH", help="write the requests of the scenarios to a JSONL log for replay.py")
+    args = parser.parse_args()
+    if args.end_to_end and (args.sink == "null" or args.memory):
+        parser.error("--end-to-end always posts to the stub and does not trace memory")
+    if args.end_to_end and len(args.scenarios) != 1:
+        # the dApp loop of a scenario cannot be stopped, it would steal the inputs of the next one
+        parser.error("--end-to-end runs a single scenario per process")
+    logging.getLogger().setLevel(args.log_level)
+    record = open(args.record, "w") if args.record else None
+    failed = False
+
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name}, choose from {', '.join(SCENARIOS)}")
+        stub = RollupStub().start()
+        if args.memory:
+            tracemalloc.start()
+        script = recorded(SCENARIOS[name](), record) if record else SCENARIOS[name]()
+        start = time.perf_counter()
+        if args.end_to_end:
+            latencies, peaks, statuses, mismatches = run_end_to_end(script, stub)
+        else:
+            latencies, peaks, statuses, mismatches = run_in_process(script, stub, args.sink, args.memory)
+        elapsed = time.perf_counter() - start
+        report(name, elapsed, latencies, peaks, statuses, stub.outputs, mismatches)
+        failed = failed or bool(mismatches)
+        if args.memory:
+            print(f"  retained {tracemalloc.get_traced_memory()[0] / 2**20:.1f} MiB after the scenario")
+            tracemalloc.stop()
+        stub.stop()
+    if record:
+        record.close()
+    print(f"\nmax RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB")
+    if failed:
+        sys.exit("some inputs did not get back what they should")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Encoded portal payloads and rollup requests for the benchmarks.
+
+The layouts match what modules.inputs decodes: ERC20Portal deposits that
+open auctions, EtherPortal deposits that place bids (with or without an
+auction id) and Forest Reserve inputs that finish auctions.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dapp"))
+
+from modules.function_selectors import SELECTORS, NEW_AUCTION, NEW_BID, NEW_BID_BY_ID, FINISH_AUCTION, FINISH_AUCTION_BY_ID
+
+
+def address(value) -> bytes:
+    """Returns a 20-byte address from raw bytes, a 0x-prefixed hex string or an int."""
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, int):
+        return value.to_bytes(20, "big")
+    return bytes.fromhex(value[2:] if value.startswith("0x") else value)
+
+
+def uint256(value: int) -> bytes:
+    return value.to_bytes(32, "big")
+
+
+def erc20_deposit(token, depositor, amount: int, duration: int, reserve_price_per_token: int, sender=None) -> bytes:
+    """ERC20Portal payload opening an auction of amount tokens."""
+    return (b"\x01" + address(token) + address(depositor) + uint256(amount) + SELECTORS[NEW_AUCTION]
+            + address(sender if sender is not None else depositor) + uint256(duration) + uint256(reserve_price_per_token))
+
+
+def ether_deposit(depositor, amount: int, erc20_interested_amount: int, auction_id=None, sender=None) -> bytes:
+    """EtherPortal payload bidding amount wei for erc20_interested_amount tokens."""
+    sender = address(sender if sender is not None else depositor)
+    if auction_id is None:
+        return address(depositor) + uint256(amount) + SELECTORS[NEW_BID] + sender + uint256(erc20_interested_amount)
+    return address(depositor) + uint256(amount) + SELECTORS[NEW_BID_BY_ID] + sender + uint256(auction_id) + uint256(erc20_interested_amount)
+
+
+def finish_auction(auction_id=None) -> bytes:
+    """Forest Reserve payload finishing the only auction, or auction_id."""
+    if auction_id is None:
+        return SELECTORS[FINISH_AUCTION]
+    return SELECTORS[FINISH_AUCTION_BY_ID] + uint256(auction_id)
+
+
+def advance(msg_sender: str, payload: bytes, timestamp: int, input_index: int) -> dict:
+    """advance_state rollup request as returned by /finish."""
+    return {
+        "request_type": "advance_state",
+        "data": {
+            "metadata": {"msg_sender": msg_sender.lower(), "epoch_index": 0, "input_index": input_index, "block_number": 0, "timestamp": timestamp},
+            "payload": "0x" + payload.hex(),
+        },
+    }
+
+
+def inspect(query: str) -> dict:
+    """inspect_state rollup request as returned by /finish."""
+    return {"request_type": "inspect_state", "data": {"payload": "0x" + query.encode().hex()}}
@@ -0,0 +1,114 @@
+"""
+Benchmark of the integer price keys against the previous float pricing.
+
+Ranks a large set of wei-scale bids both ways, checks the integer ranking
+against exact cross-multiplication and counts the pairs the float path
+gets wrong.
+
+    python benchmarks/pricing.py [bids]
+"""
+import math
+import os
+import random
+import sys
+import time
+from functools import cmp_to_key
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dapp"))
+
+from modules.models import BidStore
+from modules.pricing import price_key, price_key_shift, compare_prices, price_at_least
+
+RESERVE_PRICE_PER_TOKEN = 10**9
+
+
+class FloatBid:
+    """The previous Bid pricing: float division and floor on every access."""
+
+    def __init__(self, ether_amount: int, erc20_interested_amount: int) -> None:
+        self._ether_amount = ether_amount
+        self._erc20_interested_amount = erc20_interested_amount
+
+    @property
+    def ether_amount(self) -> int:
+        return self._ether_amount
+
+    @property
+    def erc20_interested_amount(self) -> int:
+        return self._erc20_interested_amount
+
+    @property
+    def price_per_token(self) -> int:
+        return math.floor(self._ether_amount / self._erc20_interested_amount)
+
+
+def make_bids(count: int, seed: int = 42):
+    rng = random.Random(seed)
+    bids = []
+    for _ in range(count):
+        erc20_amount = rng.randint(10**17, 10**24)
+        # prices a few wei apart so the float path has to break near-ties
+        ether_amount = erc20_amount * rng.randint(RESERVE_PRICE_PER_TOKEN, RESERVE_PRICE_PER_TOKEN + 100) + rng.randint(0, erc20_amount)
+        bids.append((ether_amount, erc20_amount))
+    # exact ties at different scales
+    for ether_amount, erc20_amount in bids[: count // 10]:
+        factor = rng.randint(2, 1000)
+        bids.append((ether_amount * factor, erc20_amount * factor))
+    rng.shuffle(bids)
+    return bids
+
+
+def float_path(bids):
+    """Reserve check and ranking as new_bid and Auction.finish used to do them."""
+    accepted = []
+    for ether_amount, erc20_amount in bids:
+        if ether_amount / erc20_amount < RESERVE_PRICE_PER_TOKEN:
+            continue
+        accepted.append(FloatBid(ether_amount, erc20_amount))
+    accepted.sort(key=lambda bid: bid.price_per_token, reverse=True)
+    return [(bid.ether_amount, bid.erc20_interested_amount) for bid in accepted]
+
+
+def integer_path(bids):
+    """Reserve check and ranking on integer price keys over the columnar store."""
+    store = BidStore()
+    for ether_amount, erc20_amount in bids:
+        if price_at_least(ether_amount, erc20_amount, RESERVE_PRICE_PER_TOKEN):
+            store.append(ether_amount, "0x", erc20_amount)
+    ether_amounts = store.ether_amounts
+    erc20_amounts = store.erc20_amounts
+    shift = price_key_shift(max(erc20_amounts))
+    keys = [price_key(ether_amount, erc20_amount, shift) for ether_amount, erc20_amount in zip(ether_amounts, erc20_amounts)]
+    order = sorted(range(len(keys)), key=keys.__getitem__, reverse=True)
+    return [(ether_amounts[index], erc20_amounts[index]) for index in order]
+
+
+def misordered_pairs(ranking) -> int:
+    return sum(compare_prices(*ranking[i], *ranking[i + 1]) < 0 for i in range(len(ranking) - 1))
+
+
+def timed(function, bids, repeat: int = 3):
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(bids)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(count: int) -> None:
+    bids = make_bids(count)
+    float_time, float_ranking = timed(float_path, bids)
+    integer_time, integer_ranking = timed(integer_path, bids)
+
+    exact = sorted(bids, key=cmp_to_key(lambda a, b: compare_prices(*a, *b)), reverse=True)
+    assert [compare_prices(*a, *b) for a, b in zip(integer_ranking, exact)] == [0] * len(exact), "integer keys disagree with cross-multiplication"
+
+    print(f"{len(bids)} bids")
+    print(f"float path:   {float_time * 1e3:9.1f} ms, {misordered_pairs(float_ranking)} adjacent pairs out of order")
+    print(f"integer path: {integer_time * 1e3:9.1f} ms, {misordered_pairs(integer_ranking)} adjacent pairs out of order")
+    print(f"integer / float time: {integer_time / float_time:.2f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
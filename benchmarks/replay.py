@@ -0,0 +1,179 @@
+"""
+Deterministic replay of a recorded input log.
+
+Re-executes a JSONL log of /finish responses, one rollup request per line
+as the dApp records them with RECORD_PATH (or load.py --record writes them),
+through handle_advance and handle_inspect of a fresh copy of
+dapp/auction.py, in-process and without a Cartesi node. Outputs go to a
+sink that drops them after hashing the vouchers and notices of every input,
+so a replay can be checked against the hashes of a known good one.
+
+    python benchmarks/replay.py inputs.jsonl [--write hashes.jsonl] [--check hashes.jsonl]
+                                             [--profile] [--slowest 10] [--cprofile out.prof]
+
+Logs ending in .gz are read compressed. The dApp settings that change its
+behaviour (AUTO_SETTLE, MERGE_BIDS, ...) are taken from the environment, so
+set them as the recorded node had them; snapshots, metrics dumps and
+recording are turned off.
+"""
+import argparse
+import gzip
+import hashlib
+import heapq
+import json
+import logging
+import os
+import sys
+import time
+from typing import IO, Iterator, List, Optional, Tuple
+
+# the replay must not write over the snapshots, metrics or log of a node
+for variable in ("SNAPSHOT_PATH", "METRICS_PATH", "RECORD_PATH"):
+    os.environ.pop(variable, None)
+
+from load import load_dapp
+from modules.metrics import METRICS
+from modules.outputs import Base, BasePipeline
+
+# outputs that are part of the verifiable rollup state; reports are not
+HASHED_OUTPUTS = ("voucher", "notice")
+
+
+class HashingPipeline(BasePipeline):
+    """Output sink that drops every output, folding the vouchers and notices of each input into a hash."""
+
+    def __init__(self) -> None:
+        super().__init__(None)
+        self._hash = hashlib.sha256()
+        self.outputs = 0
+
+    def enqueue(self, endpoint: str, json_data: dict) -> None:
+        if endpoint in HASHED_OUTPUTS:
+            self._hash.update(f"{endpoint} {json_data.get('destination', '')} {json_data['payload']}\n".encode())
+            self.outputs += 1
+
+    def flush(self) -> int:
+        return 0
+
+    def take(self) -> Tuple[int, str]:
+        """Returns the number of hashed outputs and their hash since the last take, and starts over."""
+        outputs, digest = self.outputs, self._hash.hexdigest()
+        self._hash = hashlib.sha256()
+        self.outputs = 0
+        return outputs, digest
+
+
+class SlowestStages:
+    """Metrics hook keeping the slowest stage timings of the replay, with the input they belong to."""
+
+    def __init__(self, keep: int) -> None:
+        self._keep = keep
+        self._slowest: List[Tuple[float, str, int]] = []
+        self.index = -1
+
+    def __call__(self, stage: str, seconds: float) -> None:
+        if len(self._slowest) < self._keep:
+            heapq.heappush(self._slowest, (seconds, stage, self.index))
+        elif seconds > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, (seconds, stage, self.index))
+
+    def report(self) -> None:
+        print(f"\n  {'slowest stage':<28}{'input':>10}{'ms':>10}")
+        for seconds, stage, index in sorted(self._slowest, reverse=True):
+            print(f"  {stage:<28}{index:>10}{seconds * 1e3:>10.3f}")
+
+
+def read_log(path: str) -> Iterator[dict]:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt") as log:
+        for line in log:
+            if line.strip():
+                yield json.loads(line)
+
+
+def replay(path: str, write: Optional[IO], check: Optional[Iterator[dict]], slowest: Optional[SlowestStages], profile: bool) -> int:
+    """Replays the log and returns the number of inputs whose outputs or status differ from check."""
+    dapp = load_dapp("http://127.0.0.1:0")
+    # stage timings are only collected when asked for, they cost a few percent
+    METRICS.reset()
+    METRICS.enabled = profile
+    pipeline = HashingPipeline()
+    Base.use_pipeline(pipeline)
+    chain = hashlib.sha256()
+    counts = {"advance_state": 0, "inspect_state": 0}
+    mismatches = 0
+    start = time.perf_counter()
+
+    for index, request in enumerate(read_log(path)):
+        if slowest:
+            slowest.index = index
+        request_type = request["request_type"]
+        status = dapp.handlers[request_type](request["data"])
+        outputs, digest = pipeline.take()
+        counts[request_type] += 1
+        chain.update(f"{status} {digest}".encode())
+        entry = {"index": index, "request_type": request_type, "status": status, "outputs": outputs, "hash": digest}
+        if write:
+            write.write(json.dumps(entry) + "\n")
+        if check is not None:
+            expected = next(check, None)
+            if expected != entry:
+                mismatches += 1
+                if mismatches <= 10:
+                    print(f"input {index} differs: expected {expected}, replayed {entry}", file=sys.stderr)
+
+    elapsed = time.perf_counter() - start
+    if check is not None and next(check, None) is not None:
+        mismatches += 1
+        print("the expected hashes cover more inputs than the log", file=sys.stderr)
+    total = sum(counts.values())
+    print(f"replayed {total} inputs ({counts['advance_state']} advance, {counts['inspect_state']} inspect) in {elapsed:.2f}s, {total / elapsed if elapsed else 0:,.0f} inputs/s")
+    print(f"outputs hash {chain.hexdigest()}")
+    return mismatches
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("log", help="JSONL log of rollup requests, optionally gzipped")
+    parser.add_argument("--write", metavar="PATH", help="write the status and outputs hash of every input to PATH")
+    parser.add_argument("--check", metavar="PATH", help="compare every input with the hashes written by a previous --write")
+    parser.add_argument("--profile", action="store_true", help="print the timing of every handler stage")
+    parser.add_argument("--slowest", type=int, default=0, metavar="N", help="list the N slowest stage timings and their inputs")
+    parser.add_argument("--cprofile", metavar="PATH", help="run under cProfile and save the stats to PATH")
+    parser.add_argument("--log-level", default="WARNING", help="level of the dApp logs")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(args.log_level)
+
+    slowest = SlowestStages(args.slowest) if args.slowest else None
+    if slowest:
+        METRICS.add_hook(slowest)
+
+    write = open(args.write, "w") if args.write else None
+    check_file = open(args.check) if args.check else None
+    check = (json.loads(line) for line in check_file) if check_file else None
+    try:
+        if args.cprofile:
+            import cProfile
+            profiler = cProfile.Profile()
+            mismatches = profiler.runcall(replay, args.log, write, check, slowest, args.profile)
+            profiler.dump_stats(args.cprofile)
+        else:
+            mismatches = replay(args.log, write, check, slowest, args.profile)
+    finally:
+        for file in (write, check_file):
+            if file:
+                file.close()
+
+    if args.profile:
+        print(f"\n  {'stage':<28}{'count':>10}{'total ms':>12}{'avg ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for stage, summary in METRICS.summary()["stages"].items():
+            print(f"  {stage:<28}{summary['count']:>10}{summary['total_ms']:>12.1f}{summary['avg_ms']:>10.3f}{summary['p99_ms']:>10.3f}{summary['max_ms']:>10.3f}")
+    if slowest:
+        slowest.report()
+    if args.check:
+        print(f"{mismatches} inputs differ from {args.check}" if mismatches else f"every input matches {args.check}")
+        sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
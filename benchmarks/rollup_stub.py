@@ -0,0 +1,127 @@
+"""
+Local stand-in for the rollup HTTP server.
+
+Serves /voucher, /notice and /report by counting the outputs, and /finish
+by handing out the next scripted rollup request (202 once the script is
+exhausted). The script holds (label, request) pairs; the time between
+handing out a request and the next /finish is recorded under its label,
+which is the latency a Cartesi node would see per input.
+
+    python benchmarks/rollup_stub.py [port]
+"""
+import json
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Deque, Dict, List, Optional, Tuple
+
+OUTPUT_ENDPOINTS = ("voucher", "notice", "report")
+
+
+class RollupStub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, keep_outputs: bool = False) -> None:
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.keep_outputs = keep_outputs
+        self.script: Deque[Tuple[str, dict]] = deque()
+        self.outputs: Dict[str, int] = dict.fromkeys(OUTPUT_ENDPOINTS, 0)
+        self.kept: List[Tuple[str, dict]] = []
+        self.statuses: List[str] = []
+        # vouchers posted while each request was handled, in step with statuses
+        self.vouchers: List[int] = []
+        # (label, seconds between handing the request out and the next /finish)
+        self.latencies: List[Tuple[str, float]] = []
+        self.drained = threading.Event()
+        self._lock = threading.Lock()
+        self._pending: Optional[Tuple[str, float]] = None
+        self._pending_vouchers = 0
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def start(self) -> "RollupStub":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def load(self, requests) -> None:
+        """Appends (label, rollup request) pairs to the script served by /finish."""
+        with self._lock:
+            self.script.extend(requests)
+            self.drained.clear()
+
+    def output(self, endpoint: str, body: dict) -> None:
+        with self._lock:
+            self.outputs[endpoint] += 1
+            if endpoint == "voucher":
+                self._pending_vouchers += 1
+            if self.keep_outputs:
+                self.kept.append((endpoint, body))
+
+    def finish(self, body: dict) -> Optional[dict]:
+        now = time.perf_counter()
+        with self._lock:
+            if self._pending is not None:
+                label, started = self._pending
+                self.latencies.append((label, now - started))
+                self.statuses.append(body.get("status"))
+                self.vouchers.append(self._pending_vouchers)
+                self._pending = None
+            self._pending_vouchers = 0
+            if not self.script:
+                self.drained.set()
+                return None
+            label, request = self.script.popleft()
+            self._pending = (label, time.perf_counter())
+            return request
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # one buffered write per response, so small replies are not held back by Nagle
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        endpoint = self.path.strip("/")
+        if endpoint == "finish":
+            request = self.server.finish(body)
+            if request is None:
+                self._reply(202, b"")
+            else:
+                self._reply(200, json.dumps(request).encode())
+        elif endpoint in OUTPUT_ENDPOINTS:
+            self.server.output(endpoint, body)
+            self._reply(200, b'{"index": 0}')
+        else:
+            self._reply(404, b"")
+
+    def _reply(self, code: int, content: bytes) -> None:
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+if __name__ == "__main__":
+    stub = RollupStub(int(sys.argv[1]) if len(sys.argv) > 1 else 5004)
+    print(f"Rollup stub listening on {stub.url}")
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        print(f"Outputs {stub.outputs}")
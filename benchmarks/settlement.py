@@ -0,0 +1,112 @@
+"""
+Settlement encoding benchmark, inline against the encoding pool.
+
+Builds a settlement plan with one token transfer and one ether refund per
+bidder, encodes its vouchers inline and through an EncodingPool of each
+requested size, and checks that every pooled run yields the inline vouchers
+in the same order.
+
+Before timing, executes the vouchers of a small plan the way the dApp
+contract would on L1: it is the caller of every voucher, only it may call
+its own withdrawEther and a token transfer spends its balance. Every call
+must be one its target can make, and the receivers must end up with what
+they are owed.
+
+    python benchmarks/settlement.py [--bidders 100000] [--workers 2 4]
+
+The pool never uses more workers than there are cores, and runs inline on a
+single core, as it would inside the Cartesi machine.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dapp"))
+
+from eth_abi import decode
+from modules.function_selectors import SELECTORS, ERC20_TRANSFER, ETHER_WITHDRAWAL
+from modules.settlement import ETHER, SettlementPlan
+from modules.workers import EncodingPool
+
+TOKEN = "0x" + "77" * 20
+# paid to few receivers
+SMALL_TOKEN = "0x" + "78" * 20
+# the dApp contract: the rollup address vouchers withdraw ether from, and their caller
+ROLLUP_ADDRESS = "0x" + "dd" * 20
+
+
+def settlement(bidders: int) -> SettlementPlan:
+    plan = SettlementPlan()
+    for bidder in range(bidders):
+        receiver = f"0x{bidder + 1:040x}"
+        plan.credit(TOKEN, receiver, 10 + bidder % 1000)
+        plan.credit(ETHER, receiver, 10**15 + bidder)
+        if bidder < 2:
+            plan.credit(SMALL_TOKEN, receiver, 1)
+    return plan
+
+
+def execute(vouchers) -> dict:
+    """Amounts each receiver is paid per asset once the dApp executes the vouchers; fails on a call its target cannot make."""
+    paid = {}
+    for voucher in vouchers:
+        destination = voucher["destination"]
+        payload = bytes.fromhex(voucher["payload"][2:])
+        selector, arguments = payload[:4], payload[4:]
+        if selector == SELECTORS[ETHER_WITHDRAWAL]:
+            assert destination == ROLLUP_ADDRESS, f"withdrawEther called on {destination}, only the dApp may withdraw its ether"
+            asset = ETHER
+        elif selector == SELECTORS[ERC20_TRANSFER]:
+            asset = destination
+        else:
+            raise AssertionError(f"unexpected call {selector.hex()} to {destination}")
+        receiver, amount = decode(["address", "uint256"], arguments)
+        owed = paid.setdefault(asset, {})
+        owed[receiver.lower()] = owed.get(receiver.lower(), 0) + amount
+    return paid
+
+
+def check(bidders: int) -> None:
+    plan = settlement(bidders)
+    paid = execute(plan.vouchers(ROLLUP_ADDRESS))
+    for asset in (TOKEN, SMALL_TOKEN, ETHER):
+        assert paid.get(asset) == plan.owed(asset), f"{asset} not paid as owed"
+    assert plan.vouchers_sent == plan.transfers, plan.summary()
+
+
+def timed(plan: SettlementPlan, pool):
+    start = time.perf_counter()
+    vouchers = list(plan.vouchers(ROLLUP_ADDRESS, pool=pool))
+    return vouchers, time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--bidders", type=int, default=100000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4])
+    parser.add_argument("--log-level", default="WARNING", help="level of the dApp logs")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(args.log_level)
+
+    check(100)
+    print("the vouchers only make calls their targets can make, and pay what is owed")
+
+    plan = settlement(args.bidders)
+    inline, elapsed = timed(plan, None)
+    print(f"{'inline':<12}{len(inline):>10} vouchers {elapsed * 1e3:10.1f} ms")
+    for workers in args.workers:
+        pool = EncodingPool(workers=workers, min_items=0)
+        try:
+            pooled, elapsed = timed(plan, pool)
+        finally:
+            pool.close()
+        label = f"{workers} workers" if pool.enabled else f"{workers} (inline)"
+        assert pooled == inline, f"the vouchers of {label} differ from the inline ones"
+        print(f"{label:<12}{len(pooled):>10} vouchers {elapsed * 1e3:10.1f} ms")
+    print(f"{os.cpu_count()} cores, every run matches the inline vouchers")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Import-time profile of the dApp.
+
+Imports dapp/auction.py in a fresh interpreter with -X importtime and
+reports the total import time and the slowest modules, cumulative of their
+own imports. With --budget-ms the script exits non-zero when the import
+takes longer, so startup regressions can be caught by `make profile-imports`.
+
+    python benchmarks/startup.py [--top 15] [--runs 5] [--budget-ms 150]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+DAPP = os.path.join(BENCHMARKS, "..", "dapp")
+
+NETWORK = os.environ.get("NETWORK", "sepolia")
+
+
+def import_times() -> Tuple[int, Dict[str, int]]:
+    """Imports auction once and returns its cumulative import time and every module's, in microseconds."""
+    env = dict(os.environ, NETWORK=NETWORK, ROLLUP_HTTP_SERVER_URL="http://127.0.0.1:1", LOG_LEVEL="WARNING")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import auction"],
+        cwd=DAPP, env=env, capture_output=True, text=True, check=False,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing auction failed:\n{result.stderr}")
+    modules: Dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # -X importtime reports a module once, the first time it is imported,
+        # after its own imports; an unindented module other than auction is
+        # interpreter startup (site and its .pth imports) and is left out
+        if name[1:] == name.strip() and name.strip() != "auction":
+            modules.clear()
+            continue
+        modules[name.strip()] = int(cumulative)
+    return modules["auction"], modules
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--top", type=int, default=15, help="number of slowest modules to list")
+    parser.add_argument("--runs", type=int, default=5, help="imports to run, the fastest one is reported")
+    parser.add_argument("--budget-ms", type=float, help="fail when importing auction takes longer")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    total, modules = min((import_times() for _ in range(args.runs)), key=lambda run: run[0])
+    slowest: List[Tuple[str, int]] = sorted(
+        ((name, cumulative) for name, cumulative in modules.items() if name != "auction"),
+        key=lambda item: item[1], reverse=True,
+    )[:args.top]
+
+    if args.json:
+        print(json.dumps({"total_ms": total / 1000, "modules": {name: cumulative / 1000 for name, cumulative in slowest}}))
+    else:
+        print(f"import auction: {total / 1000:.1f} ms ({len(modules)} modules)")
+        print(f"{'module':<40}{'cumulative':>14}")
+        for name, cumulative in slowest:
+            print(f"{name:<40}{cumulative / 1000:>11.1f} ms")
+
+    if args.budget_ms is not None and total / 1000 > args.budget_ms:
+        print(f"import auction took {total / 1000:.1f} ms, over the {args.budget_ms:g} ms budget", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
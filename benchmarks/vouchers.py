@@ -0,0 +1,51 @@
+"""
+Micro-benchmark of the voucher payload encoders.
+
+Compares the prebuilt-template encoder in modules.voucher_encoder, one
+voucher at a time and in batches, with the previous eth_abi.encode path.
+
+    python benchmarks/vouchers.py [vouchers]
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dapp"))
+
+from eth_abi import encode
+from modules.convertions import Convertions as convert
+from modules.function_selectors import SELECTORS, ERC20_TRANSFER
+from modules.voucher_encoder import VoucherEncoder
+
+SELECTOR = SELECTORS[ERC20_TRANSFER]
+ENCODER = VoucherEncoder(SELECTOR)
+
+
+def codec_payload(receiver, amount):
+    return convert.binary2hex(SELECTOR + encode(['address', 'uint256'], [receiver, amount]))
+
+
+def main(count: int) -> None:
+    rng = random.Random(3)
+    transfers = [("0x" + rng.randbytes(20).hex(), rng.randrange(2**128)) for _ in range(count)]
+
+    expected = [codec_payload(receiver, amount) for receiver, amount in transfers]
+    assert [ENCODER.encode_hex(receiver, amount) for receiver, amount in transfers] == expected, "encode_hex disagrees with eth_abi"
+    assert ENCODER.encode_batch_hex(transfers) == expected, "encode_batch_hex disagrees with eth_abi"
+
+    cases = [
+        ("eth_abi.encode", lambda: [codec_payload(receiver, amount) for receiver, amount in transfers]),
+        ("template", lambda: [ENCODER.encode_hex(receiver, amount) for receiver, amount in transfers]),
+        ("template batch", lambda: ENCODER.encode_batch_hex(transfers)),
+    ]
+    baseline = None
+    print(f"{'encoder':<16}{'per voucher':>14}{'speedup':>10}")
+    for name, run in cases:
+        elapsed = min(timeit.repeat(run, number=1, repeat=5)) / count
+        baseline = baseline or elapsed
+        print(f"{name:<16}{elapsed * 1e6:>11.2f} us{baseline / elapsed:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -10,27 +10,73 @@
 # CONDITIONS OF ANY KIND, either express or implied. See the License for the
 # specific language governing permissions and limitations under the License.
 
-import web3
 import json
-import requests
 import traceback
 from os import environ
+from itertools import chain
+from typing import Iterator, List, Optional
 from modules import Logger
-from modules import Auction, Bid, AuctionState
+from modules import Auction, Bid, AuctionState, AuctionRegistry
 from modules import Inputs as input
-from modules import Notice, Report, Voucher
+from modules import TraceLevel
+from modules import Notice, Report, Voucher, AsyncOutputPipeline
 from modules import Convertions as convert
+from modules.pricing import price_at_least
+from modules import snapshot
+from modules import METRICS
+from modules import ReadModel
+from modules import Rejected, RejectionReports
+from modules.inputs import peek_bid
+from modules.clearing import ENGINES, PAY_AS_BID
+from modules.settlement import SettlementPlan
+from modules.workers import EncodingPool
+from modules.snapshot import Snapshot
+from modules.function_selectors import verify_selectors, HEX_SELECTORS, SELECTORS, NEW_AUCTION, NEW_BID, NEW_BID_BY_ID, FINISH_AUCTION, FINISH_AUCTION_BY_ID
 
 NETWORK = environ["NETWORK"]
 ROLLUP_SERVER = environ["ROLLUP_HTTP_SERVER_URL"]
+ASYNC_LOOP = environ.get("ASYNC_LOOP", "false").lower() == "true"
+DECODE_TRACE = TraceLevel[environ.get("DECODE_TRACE", "off").upper()]
+DECODE_TRACE_SAMPLE = int(environ.get("DECODE_TRACE_SAMPLE", "1"))
+SNAPSHOT_PATH = environ.get("SNAPSHOT_PATH")
+SNAPSHOT_EVERY = int(environ.get("SNAPSHOT_EVERY", "0"))
+AUTO_SETTLE = environ.get("AUTO_SETTLE", "true").lower() == "true"
+METRICS_ENABLED = environ.get("METRICS", "on").lower() != "off"
+METRICS_PATH = environ.get("METRICS_PATH")
+METRICS_EVERY = int(environ.get("METRICS_EVERY", "100"))
+SETTLEMENT_CHUNK_SIZE = 256
+MERGE_BIDS = environ.get("MERGE_BIDS", "false").lower() == "true"
+MAX_BIDS_PER_SENDER = int(environ.get("MAX_BIDS_PER_SENDER", "0"))
+VERIFY_SELECTORS = environ.get("VERIFY_SELECTORS", "false").lower() == "true"
+REJECTION_REPORT_LIMIT = int(environ.get("REJECTION_REPORT_LIMIT", "10"))
+REJECTION_REPORT_WINDOW = int(environ.get("REJECTION_REPORT_WINDOW", "60"))
+RECORD_PATH = environ.get("RECORD_PATH")
+CLEARING_MODE = environ.get("CLEARING_MODE", PAY_AS_BID).lower()
+# host mode only: processes encoding the vouchers of large settlements, 0 encodes inline
+SETTLEMENT_WORKERS = int(environ.get("SETTLEMENT_WORKERS", "0"))
+SETTLEMENT_WORKERS_MIN_PAYMENTS = int(environ.get("SETTLEMENT_WORKERS_MIN_PAYMENTS", "4096"))
 
 LOGGER = Logger(level="INFO", name=__name__).logger
 
-AUCTION: Auction = None
-AUCTION_STATE = AuctionState.NOT_HAPPENING
+AUCTIONS = AuctionRegistry()
+READ_MODEL = ReadModel()
+REJECTIONS = RejectionReports(limit=REJECTION_REPORT_LIMIT, window=REJECTION_REPORT_WINDOW)
+ENCODING_POOL = EncodingPool(workers=SETTLEMENT_WORKERS, min_items=SETTLEMENT_WORKERS_MIN_PAYMENTS)
+LAST_INPUT_INDEX = -1
+# index of the input the restored snapshot covers, None when none was loaded
+SNAPSHOT_INPUT_INDEX = None
+SNAPSHOT_DUE = False
+RECORD_FILE = None
 NOTICE = Notice(rollup_server=ROLLUP_SERVER)
 REPORT = Report(rollup_server=ROLLUP_SERVER)
 VOUCHER = Voucher(rollup_server=ROLLUP_SERVER)
+input.configure_trace(level=DECODE_TRACE, sample_every=DECODE_TRACE_SAMPLE)
+METRICS.enabled = METRICS_ENABLED
+if CLEARING_MODE not in ENGINES:
+    raise ValueError(f"Unknown CLEARING_MODE {CLEARING_MODE}, use one of {', '.join(ENGINES)}")
+Auction.clearing_engine = ENGINES[CLEARING_MODE]
+if VERIFY_SELECTORS:
+    verify_selectors()
 
 networks = json.load(open("networks.json"))
 
@@ -44,202 +90,333 @@ FOREST_RESERVE_ADDRESS = networks[NETWORK]["FOREST_RESERVE_ADDRESS"].lower()
 LOGGER.info(f"HTTP rollup_server url is {ROLLUP_SERVER}, network is {NETWORK} and rollup address is {ROLLUP_ADDRESS}")
 LOGGER.info(f'Forest Reserve address is {FOREST_RESERVE_ADDRESS}, EtherPortal address is {ETHER_PORTAL_ADDRESS}, ERC20Portal address is {ERC20_PORTAL_ADDRESS} and ERC721Portal address is {ERC721_PORTAL_ADDRESS}')
 
-def new_auction(token_address, amount: int, function_signature, sender, duration: int, reserve_price_per_token: int, timestamp: int) -> None:
-    global AUCTION
-    global AUCTION_STATE
-
+def new_auction(token_address, amount: int, function_signature, sender, duration: int, reserve_price_per_token: int, timestamp: int) -> Optional[Auction]:
+    watch = METRICS.stopwatch("new_auction")
     if any(arg is None for arg in [sender, duration, amount, token_address, reserve_price_per_token, timestamp]):
-        REPORT.send({"payload": convert.str2hex("None of the arguments can be None in new auction")})
-        raise ValueError("None of the arguments can be None")
-    
-    if function_signature != hex(int.from_bytes(web3.Web3().keccak(b'newAuction(uint256,uint256,uint256)')[:4], 'big')):
-        REPORT.send({"payload": convert.str2hex("Function signature is not correct in new auction")})
-        raise ValueError("Function signature is not correct")
+        raise Rejected("None of the arguments can be None in new auction")
     
-    if AUCTION_STATE == AuctionState.HAPPENING:
-        REPORT.send({"payload": convert.str2hex("There is already an auction happening in new auction")})
-        raise ValueError("There is already an auction happening")
+    if function_signature != HEX_SELECTORS[NEW_AUCTION]:
+        raise Rejected("Function signature is not correct in new auction")
     
     if any(arg <= 0 for arg in [duration, amount, reserve_price_per_token]):
-        REPORT.send({"payload": convert.str2hex("Invalid arguments: Duration, amount, and reserve price per token must be greater than 0 in new auction")})
-        raise ValueError("Invalid arguments: Duration, amount, and reserve price per token must be greater than 0")
+        raise Rejected("Invalid arguments: Duration, amount, and reserve price per token must be greater than 0 in new auction")
+    watch.lap("validate")
     
     try:
-        AUCTION = Auction(sender=sender, duration=duration, amount=amount, token_address=token_address, reserve_price_per_token=reserve_price_per_token, timestamp=timestamp)
-        AUCTION_STATE = AuctionState.HAPPENING
-        return True
+        auction = AUCTIONS.create(sender=sender, duration=duration, amount=amount, token_address=token_address, reserve_price_per_token=reserve_price_per_token, timestamp=timestamp)
+        watch.lap("update")
+        return auction
     except Exception as e:
         msg = f"Error {e} processing new auction"
         LOGGER.info(f"{msg}\n{traceback.format_exc()}")
         REPORT.send({"payload": convert.str2hex(msg)})
-        return False
-
-def new_bid(amount: int, function_signature, sender, erc20_interested_amount: int):
-    global AUCTION
-    global AUCTION_STATE
+        return None
 
-    if any(arg is None for arg in [amount, sender, erc20_interested_amount]):
-        REPORT.send({"payload": convert.str2hex("None of the arguments can be None in new bid")})
-        raise ValueError("None of the arguments can be None")
-    
-    if function_signature != hex(int.from_bytes(web3.Web3().keccak(b'newBid(uint256)')[:4], 'big')):
-        REPORT.send({"payload": convert.str2hex("Function signature is not correct in new bid")})
-        raise ValueError("Function signature is not correct")
+def resolve_auction(auction_id: Optional[int], context: str) -> Auction:
+    try:
+        return AUCTIONS.resolve(auction_id)
+    except ValueError as e:
+        raise Rejected(f"{e} in {context}") from None
+
+def admit_bid(amount: int, erc20_interested_amount: int, timestamp: int, auction_id: Optional[int] = None) -> Auction:
+    """
+    Checks a bid against its auction, the checks that need no decoded
+    address, and returns the auction. advance_new_bid runs them on the raw
+    payload so that invalid bids are rejected before anything is built.
+    """
+    auction = resolve_auction(auction_id, "new bid")
     
-    if AUCTION_STATE == AuctionState.NOT_HAPPENING:
-        REPORT.send({"payload": convert.str2hex("There is no auction happening in new bid")})
-        raise ValueError("There is no auction happening")
-    
-    if any(arg <= 0 for arg in [amount, erc20_interested_amount]):
-        REPORT.send({"payload": convert.str2hex("Invalid arguments: Amount of Ether and ERC20 interested amount must be greater than 0")})
-        raise ValueError("Invalid arguments: Amount of Ether and ERC20 interested amount must be greater than 0")
-
-    if amount / erc20_interested_amount < AUCTION.reserve_price_per_token:
-        REPORT.send({"payload": convert.str2hex("Bid is lower than reserve price in new bid")})
-        raise ValueError("Bid is lower than reserve price")
+    if auction.remaining_time(timestamp) <= 0:
+        raise Rejected("Auction is finished in new bid")
+
+    if amount <= 0 or erc20_interested_amount <= 0:
+        raise Rejected("Invalid arguments: Amount of Ether and ERC20 interested amount must be greater than 0")
+
+    if not price_at_least(amount, erc20_interested_amount, auction.reserve_price_per_token):
+        raise Rejected("Bid is lower than reserve price in new bid")
+    return auction
+
+def place_bid(auction: Auction, amount: int, sender, erc20_interested_amount: int, watch) -> Optional[Auction]:
+    """Places a bid admit_bid has accepted into auction; only the per-sender cap is left to check."""
+    # the cap is on positions: a top-up merged into an existing one is always let through
+    if MAX_BIDS_PER_SENDER and auction.bid_count(sender) >= MAX_BIDS_PER_SENDER and not (MERGE_BIDS and auction.bids.same_price_position(sender, amount, erc20_interested_amount) is not None):
+        raise Rejected(f"Sender {sender} already holds {MAX_BIDS_PER_SENDER} bids in new bid")
+    watch.lap("validate")
     
     try:
-        if AUCTION.add_bid(Bid(amount, sender, erc20_interested_amount)):
-            return True
+        if auction.add_bid(Bid(amount, sender, erc20_interested_amount), merge=MERGE_BIDS):
+            watch.lap("update")
+            return auction
     except Exception as e:
         msg = f"Error {e} processing new bid"
         LOGGER.info(f"{msg}\n{traceback.format_exc()}")
         REPORT.send({"payload": convert.str2hex(msg)})
-        return False
-
-def finish_auction(function_signature, timestamp: int):
-    global AUCTION
-    global AUCTION_STATE
+        return None
 
+def finish_auction(function_signature, timestamp: int, auction_id: Optional[int] = None):
+    watch = METRICS.stopwatch("finish_auction")
     if any(arg is None for arg in [function_signature, timestamp]):
-        REPORT.send({"payload": convert.str2hex("None of the arguments can be None in finish auction")})
-        raise ValueError("None of the arguments can be None")
+        raise Rejected("None of the arguments can be None in finish auction")
     
-    if function_signature != hex(int.from_bytes(web3.Web3().keccak(b'finishAuction()')[:4], 'big')):
-        REPORT.send({"payload": convert.str2hex("Function signature is not correct in finish auction")})
-        raise ValueError("Function signature is not correct")
+    if function_signature not in (HEX_SELECTORS[FINISH_AUCTION], HEX_SELECTORS[FINISH_AUCTION_BY_ID]):
+        raise Rejected("Function signature is not correct in finish auction")
     
-    if AUCTION_STATE == AuctionState.NOT_HAPPENING:
-        REPORT.send({"payload": convert.str2hex("There is no auction happening in finish auction")})
-        raise ValueError("There is no auction happening")
+    auction = resolve_auction(auction_id, "finish auction")
     
-    if AUCTION.remaining_time(timestamp) > 0:
-        REPORT.send({"payload": convert.str2hex("Auction is not finished in finish auction")})
-        raise ValueError("Auction is not finished")
+    if auction.remaining_time(timestamp) > 0:
+        raise Rejected("Auction is not finished in finish auction")
+    watch.lap("validate")
     
-    try:
-        vouchers = []
-        selected_bids, unselected_bids, total_ether, token_address, remaining_erc20_amount, sender = AUCTION.finish(timestamp=timestamp)
-
-        if any(arg is None for arg in [selected_bids, unselected_bids, total_ether, token_address, remaining_erc20_amount, sender ]):
-            REPORT.send({"payload": convert.str2hex("None of the arguments can be None in finish auction")})
-            raise ValueError("None of the arguments can be None")
-        
-        for selected_bid, unselected_bid in zip(selected_bids, unselected_bids):
-            voucher_selected = VOUCHER.create_erc20_transfer_voucher(selected_bid.sender, selected_bid.erc20_interested_amount, token_address)
-            voucher_unselected = VOUCHER.create_ether_voucher(unselected_bid.sender, unselected_bid.ether_amount, ROLLUP_ADDRESS)
+    NOTICE.send({"payload": convert.str2hex(f"Finish auction {auction.auction_id}")})
+    return settle_auction(auction, timestamp)
+
+def settle_auction(auction: Auction, timestamp: int) -> Iterator[dict]:
+    """
+    Finishes auction and removes it from the registry right away. The
+    vouchers that pay out its bidders and its seller are produced lazily so
+    they can be streamed to the output pipeline.
+    """
+    AUCTIONS.remove(auction.auction_id)
+    plan = SettlementPlan()
+    auction.finish(timestamp=timestamp, plan=plan)
+    return _settlement_vouchers(plan, [auction.auction_id])
+
+def _settlement_vouchers(plan: SettlementPlan, auction_ids: List[int]) -> Iterator[dict]:
+    # one voucher per receiver and asset, encoded a chunk at a time
+    yield from plan.vouchers(ROLLUP_ADDRESS, SETTLEMENT_CHUNK_SIZE, pool=ENCODING_POOL)
+    METRICS.count("settlement.payments", plan.payments)
+    METRICS.count("settlement.vouchers", plan.vouchers_sent)
+    if plan:
+        REPORT.send({"payload": convert.str2hex(f"Settled auction {', '.join(map(str, auction_ids))}: {plan.summary()}")})
+
+def settle_expired_auctions(timestamp: int) -> Iterator[dict]:
+    """
+    Settles every auction whose deadline is at or before timestamp, the
+    input timestamp being the clock, and yields their vouchers, netted over
+    all of them. Settlement waits until the rollup address is known, since
+    the ether vouchers are sent to it.
+    """
+    if not AUTO_SETTLE or ROLLUP_ADDRESS is None:
+        return
+    expired = AUCTIONS.pop_expired(timestamp)
+    if not expired:
+        return
+    plan = SettlementPlan()
+    for auction in expired:
+        LOGGER.info(f"Auction {auction.auction_id} expired at {auction.deadline}, settled at {timestamp}")
+        METRICS.count("auctions.auto_settled")
+        NOTICE.send({"payload": convert.str2hex(f"Finish auction {auction.auction_id}")})
+        AUCTIONS.remove(auction.auction_id)
+        auction.finish(timestamp=timestamp, plan=plan)
+    yield from _settlement_vouchers(plan, [auction.auction_id for auction in expired])
+
+def advance_new_bid(binary, timestamp: int):
+    watch = METRICS.stopwatch("new_bid")
+    # fast path: size, auction and reserve price are checked on the raw payload
+    amount, erc20_interested_amount, auction_id = peek_bid(binary)
+    auction = admit_bid(amount, erc20_interested_amount, timestamp, auction_id)
+    watch.lap("admit")
+    # the route already matched the selector and admit_bid checked the amounts, only the sender is left to decode
+    decoded_data = input.decode_ether_deposit(binary)
+    watch.lap("decode")
+    auction = place_bid(auction, decoded_data.amount, decoded_data.sender, decoded_data.erc20_interested_amount, watch)
+    if auction:
+        NOTICE.send({"payload": convert.str2hex(f"New bid from {decoded_data.sender} in auction {auction.auction_id}")})
+    return []
+
+def advance_new_auction(binary, timestamp: int):
+    watch = METRICS.stopwatch("new_auction")
+    decoded_data = input.decode_erc20_deposit(binary)
+    watch.lap("decode")
+    auction = new_auction(token_address=decoded_data.token_address, amount=decoded_data.amount, function_signature=decoded_data.function_signature, sender=decoded_data.sender, duration=decoded_data.duration, reserve_price_per_token=decoded_data.reserve_price_per_token, timestamp=timestamp)
+    if auction:
+        NOTICE.send({"payload": convert.str2hex(f"New auction {auction.auction_id} from {decoded_data.sender}")})
+    return []
+
+def advance_finish_auction(binary, timestamp: int):
+    watch = METRICS.stopwatch("finish_auction")
+    decoded_data = input.decode_finish_auction(binary)
+    watch.lap("decode")
+    return finish_auction(decoded_data.function_signature, timestamp, auction_id=decoded_data.auction_id)
+
+# Offset of the 4-byte function selector inside the payload sent by each known sender
+SELECTOR_OFFSETS = {
+    ETHER_PORTAL_ADDRESS: 52,
+    ERC20_PORTAL_ADDRESS: 73,
+    FOREST_RESERVE_ADDRESS: 0,
+}
 
-            LOGGER.info(f"partially accepted bid from {unselected_bid.sender} with {unselected_bid.ether_amount} wei and {unselected_bid.erc20_interested_amount} tokens")
-            vouchers.append(voucher_selected)
-            vouchers.append(voucher_unselected)
+# Advance dispatch table keyed on (msg_sender, raw function selector)
+ADVANCE_ROUTES = {
+    (ETHER_PORTAL_ADDRESS, SELECTORS[NEW_BID]): advance_new_bid,
+    (ETHER_PORTAL_ADDRESS, SELECTORS[NEW_BID_BY_ID]): advance_new_bid,
+    (ERC20_PORTAL_ADDRESS, SELECTORS[NEW_AUCTION]): advance_new_auction,
+    (FOREST_RESERVE_ADDRESS, SELECTORS[FINISH_AUCTION]): advance_finish_auction,
+    (FOREST_RESERVE_ADDRESS, SELECTORS[FINISH_AUCTION_BY_ID]): advance_finish_auction,
+}
 
-        vouchers.append(VOUCHER.create_ether_voucher(sender, total_ether, ROLLUP_ADDRESS))
+def save_snapshot() -> None:
+    try:
+        snapshot.save(SNAPSHOT_PATH, Snapshot(LAST_INPUT_INDEX, ROLLUP_ADDRESS, AUCTIONS))
+    except Exception as e:
+        LOGGER.error(f"Error {e} saving snapshot to {SNAPSHOT_PATH}\n{traceback.format_exc()}")
+
+def save_due_snapshot() -> None:
+    """
+    Saves the snapshot handle_advance asked for. Called by the main loop
+    once /finish has returned, when the outputs of the input it covers have
+    been posted, so a restart never skips an input whose outputs were lost.
+    """
+    global SNAPSHOT_DUE
+
+    if SNAPSHOT_DUE:
+        SNAPSHOT_DUE = False
+        save_snapshot()
+
+def restore_snapshot() -> None:
+    global AUCTIONS
+    global ROLLUP_ADDRESS
+    global LAST_INPUT_INDEX
+    global SNAPSHOT_INPUT_INDEX
 
-        if remaining_erc20_amount > 0:
-            vouchers.append(VOUCHER.create_erc20_transfer_voucher(sender, remaining_erc20_amount, token_address))
+    restored = snapshot.load(SNAPSHOT_PATH)
+    if restored is not None:
+        LAST_INPUT_INDEX, ROLLUP_ADDRESS, AUCTIONS = restored
+        SNAPSHOT_INPUT_INDEX = LAST_INPUT_INDEX
+        READ_MODEL.invalidate()
 
-        AUCTION_STATE = AuctionState.NOT_HAPPENING
+def handle_advance(data):
+    global LAST_INPUT_INDEX
+    global SNAPSHOT_DUE
 
-        return vouchers
-    
-    except Exception as e:
-        msg = f"Error {e} processing finish auction"
-        LOGGER.info(f"{msg}\n{traceback.format_exc()}")
-        REPORT.send({"payload": convert.str2hex(msg)})
-        return None, None, None
+    input_index = data["metadata"].get("input_index")
+    if SNAPSHOT_INPUT_INDEX is not None and input_index is not None and input_index <= SNAPSHOT_INPUT_INDEX:
+        LOGGER.info(f"Skipping input {input_index}, already applied by the snapshot of input {SNAPSHOT_INPUT_INDEX}")
+        return "accept"
 
-def handle_advance(data):
+    watch = METRICS.stopwatch("advance")
+    status = process_advance(data)
+    # rejected inputs may have touched the state too
+    READ_MODEL.invalidate()
+    if rejection := REJECTIONS.flush(data["metadata"].get("timestamp", 0)):
+        REPORT.send({"payload": convert.str2hex(rejection)})
+    watch.lap("handle")
+    METRICS.count(f"advance.{status}")
+
+    if input_index is not None:
+        if SNAPSHOT_PATH:
+            LAST_INPUT_INDEX = input_index
+            # its outputs are still queued: the main loop saves the snapshot after the next /finish
+            SNAPSHOT_DUE = SNAPSHOT_DUE or bool(SNAPSHOT_EVERY and (input_index + 1) % SNAPSHOT_EVERY == 0)
+        if METRICS_PATH and METRICS_EVERY and (input_index + 1) % METRICS_EVERY == 0:
+            dump_metrics()
+    return status
+
+def process_advance(data):
     global ROLLUP_ADDRESS
 
-    LOGGER.info(f"Received advance request data {data}")
+    LOGGER.info("Received advance request data %s", data)
     try:
-        vouchers = []
+        vouchers = ()
         payload = data["payload"]
-        unknown_ether_deposit_withdrawal = None
-        unknown_erc20_deposit_withdrawal = None
         binary = convert.hex2binary(payload)
         sender = data["metadata"]["msg_sender"]
         timestamp = data["metadata"]["timestamp"]
 
-        if data['metadata']['msg_sender'] == DAPP_RELAY_ADDRESS:
+        if sender == DAPP_RELAY_ADDRESS:
             ROLLUP_ADDRESS = payload
             LOGGER.info(f"Set rollup_address {ROLLUP_ADDRESS}")
             NOTICE.send({"payload": convert.str2hex(f"Set rollup_address {ROLLUP_ADDRESS}")})
 
-        elif data["metadata"]["msg_sender"] == ETHER_PORTAL_ADDRESS:
-            decoded_data = input.decode_ether_deposit(binary)
-            if new_bid(amount=decoded_data["amount"], function_signature=decoded_data["function_signature"], sender=decoded_data["sender"], erc20_interested_amount=decoded_data["erc20_interested_amount"]):
-                NOTICE.send({"payload": convert.str2hex(f"New bid from {decoded_data['sender']}")})
-
-        elif data["metadata"]["msg_sender"] == ERC20_PORTAL_ADDRESS:
-            decoded_data = input.decode_erc20_deposit(binary)
-            if new_auction(token_address=decoded_data["token_address"], amount=decoded_data["amount"], function_signature=decoded_data["function_signature"], sender=decoded_data["sender"], duration=decoded_data["duration"], reserve_price_per_token=decoded_data["reserve_price_per_token"], timestamp=timestamp):
-                NOTICE.send({"payload": convert.str2hex(f"New auction from {decoded_data['sender']}")})
-        
-        elif data["metadata"]["msg_sender"] == FOREST_RESERVE_ADDRESS:
-            decoded_data = input.decode_finish_auction(binary)
-            vouchers = finish_auction(decoded_data["function_signature"], timestamp)
-            NOTICE.send({"payload": convert.str2hex(f"Finish auction")})
-                
+        elif sender in SELECTOR_OFFSETS:
+            offset = SELECTOR_OFFSETS[sender]
+            route = ADVANCE_ROUTES.get((sender, binary[offset:offset + 4]))
+            if route is None:
+                raise Rejected(f"Function signature is not correct for sender {sender}")
+            vouchers = route(binary, timestamp)
+
         else:
-            try:
-                decoded_data = input.decode_ether_deposit(binary)
-                unknown_ether_deposit_withdrawal = VOUCHER.create_ether_voucher(decoded_data["sender"], decoded_data["amount"])
-                LOGGER.info(f"Sender {sender} is unknown, creating voucher to withdraw {decoded_data['amount']} wei to {decoded_data['sender']}")
-            except:
-                try:
-                    decoded_data = input.decode_erc20_deposit(binary)
-                    unknown_erc20_deposit_withdrawal = VOUCHER.create_erc20_transfer_voucher(decoded_data["sender"], decoded_data["amount"], decoded_data["token_address"])
-                    LOGGER.info(f"Sender {sender} is unknown, creating voucher to withdraw {decoded_data['amount']} tokens to {decoded_data['sender']}")
-                except Exception as e:
-                    msg = f"Error {e} processing data {data}"
-                    LOGGER.error(f"{msg}\n{traceback.format_exc()}")
-                    REPORT.send({"payload": convert.str2hex(msg)})
-                    return "reject"
-            
-        if vouchers:
-            for voucher in vouchers:
-                VOUCHER.send(voucher)
-                
-        if unknown_ether_deposit_withdrawal:
-            VOUCHER.send(unknown_ether_deposit_withdrawal)
-            LOGGER.info(f"Created voucher to withdraw unknown sender to {decoded_data['sender']}")
-
-        if unknown_erc20_deposit_withdrawal:
-            VOUCHER.send(unknown_erc20_deposit_withdrawal)
-            LOGGER.info(f"Created voucher to withdraw unknown sender to {decoded_data['sender']}")
+            # only the portals vouch for a deposit: a direct input moved no funds, so nothing is paid back for it
+            raise Rejected(f"Sender {sender} is unknown, only portal deposits are accepted")
+
+        # vouchers are generated and sent one at a time, never held as a list
+        watch = METRICS.stopwatch("advance")
+        for voucher in chain(vouchers or (), settle_expired_auctions(timestamp)):
+            VOUCHER.send(voucher)
+        watch.lap("emit")
         return "accept"
 
+    except Rejected as e:
+        # expected, reported once per advance by handle_advance
+        LOGGER.info("Rejected input: %s", e)
+        REJECTIONS.reject(str(e))
+        return "reject"
+
     except Exception as e:
         msg = f"Error {e} processing data {data}"
         LOGGER.error(f"{msg}\n{traceback.format_exc()}")
         REPORT.send({"payload": convert.str2hex(msg)})
         return "reject"
 
-def handle_inspect(data):
-    global AUCTION
-    global AUCTION_STATE
+def dump_metrics() -> None:
+    try:
+        METRICS.dump(METRICS_PATH)
+    except OSError as e:
+        LOGGER.error(f"Error {e} dumping metrics to {METRICS_PATH}")
 
-    LOGGER.info(f"Received inspect request data {data}")
+def handle_inspect(data):
+    watch = METRICS.stopwatch("inspect")
+    status = process_inspect(data)
+    watch.lap("handle")
+    METRICS.count(f"inspect.{status}")
+    return status
+
+def process_inspect(data):
+    LOGGER.info("Received inspect request data %s", data)
     data_decoded = convert.hex2binary(data["payload"]).decode('utf-8')
+    command, *args = data_decoded.split() or [""]
     try:
-        if data_decoded == "status":
-            num_bids = 0 if AUCTION is None or AUCTION.bids is None else len(AUCTION.bids)
-            REPORT.send({"payload": convert.str2hex(f'The Auction dApp state is {AUCTION_STATE.name} and the number of bids is {num_bids}')})
+        if data_decoded.lstrip().startswith("{"):
+            request = json.loads(data_decoded)
+            REPORT.send({"payload": READ_MODEL.query(AUCTIONS, request)})
+            return "accept"
+        elif command == "status":
+            state = AuctionState.HAPPENING if len(AUCTIONS) else AuctionState.NOT_HAPPENING
+            num_bids = sum(len(auction.bids) for auction in AUCTIONS)
+            REPORT.send({"payload": convert.str2hex(f'The Auction dApp state is {state.name}, the number of auctions is {len(AUCTIONS)} and the number of bids is {num_bids}')})
+            return "accept"
+        elif command == "clearing":
+            auction = AUCTIONS.resolve(int(args[0]) if args else None)
+            status = auction.clearing_status()
+            REPORT.send({"payload": convert.str2hex(f'The clearing price per token of auction {auction.auction_id} is {status["clearing_price"]}, {status["filled_bids"]} of {status["total_bids"]} bids are filled for {status["filled_amount"]} tokens and {status["total_ether"]} wei, {status["remaining_amount"]} tokens remain')})
+            return "accept"
+        elif command == "auctions":
+            if args and args[0] == "token":
+                auctions = AUCTIONS.by_token(args[1].lower())
+            elif args and args[0] == "seller":
+                auctions = AUCTIONS.by_seller(args[1].lower())
+            else:
+                auctions = list(AUCTIONS)
+            REPORT.send({"payload": convert.str2hex(f'The auctions happening are {[auction.auction_id for auction in auctions]}')})
+            return "accept"
+        elif command == "snapshot":
+            if not SNAPSHOT_PATH:
+                raise Exception("Snapshots are disabled, set SNAPSHOT_PATH to enable them")
+            save_snapshot()
+            REPORT.send({"payload": convert.str2hex(f'Saved snapshot of input {LAST_INPUT_INDEX}')})
+            return "accept"
+        elif command == "metrics":
+            if args and args[0] == "reset":
+                METRICS.reset()
+            elif args and args[0] == "dump":
+                if not METRICS_PATH:
+                    raise Exception("Metrics dumps are disabled, set METRICS_PATH to enable them")
+                METRICS.dump(METRICS_PATH)
+            REPORT.send({"payload": convert.str2hex(json.dumps(METRICS.summary()))})
             return "accept"
         else:
             raise Exception(
-                f"Unknown payload {data['payload']}, send 'status' to get current state")
+                f"Unknown payload {data['payload']}, send a JSON query such as {{\"query\": \"top_bids\", \"n\": 10}}, 'status', 'clearing [auction id]', 'auctions [token|seller address]' or 'metrics [reset|dump]' to get current state")
 
     except Exception as e:
         msg = f"Error {e} processing data {data}"
@@ -247,21 +424,69 @@ def handle_inspect(data):
         REPORT.send({"payload": convert.str2hex(msg)})
         return "reject"
 
+def record_request(rollup_request: dict) -> None:
+    """Appends a /finish response to RECORD_PATH, the JSONL log benchmarks/replay.py re-executes."""
+    global RECORD_FILE
+
+    try:
+        if RECORD_FILE is None:
+            # line buffered, so the log is complete up to the input being handled if the dApp dies
+            RECORD_FILE = open(RECORD_PATH, "a", buffering=1)
+        RECORD_FILE.write(json.dumps(rollup_request, separators=(",", ":")) + "\n")
+    except OSError as e:
+        LOGGER.error(f"Error {e} recording request to {RECORD_PATH}")
+
 handlers = {
     "advance_state": handle_advance,
     "inspect_state": handle_inspect,
 }
 
-finish = {"status": "accept"}
+def main():
+    finish = {"status": "accept"}
 
-while True:
-    LOGGER.info("Sending finish")
-    response = requests.post(ROLLUP_SERVER + "/finish", json=finish)
-    LOGGER.info(f"Received finish status {response.status_code}")
-    if response.status_code == 202:
-        LOGGER.info("No pending rollup request, trying again")
+    while True:
+        LOGGER.info("Sending finish")
+        status_code, rollup_request = VOUCHER.pipeline.finish(finish)
+        LOGGER.info("Received finish status %s", status_code)
+        save_due_snapshot()
+        if status_code == 202:
+            LOGGER.info("No pending rollup request, trying again")
+        else:
+            if RECORD_PATH:
+                record_request(rollup_request)
+            handler = handlers[rollup_request["request_type"]]
+            finish["status"] = handler(rollup_request["data"])
+
+async def main_async():
+    import asyncio
+
+    pipeline = AsyncOutputPipeline(ROLLUP_SERVER)
+    await pipeline.start()
+    VOUCHER.use_pipeline(pipeline)
+    finish = {"status": "accept"}
+
+    try:
+        while True:
+            LOGGER.info("Sending finish")
+            status_code, rollup_request = await pipeline.finish(finish)
+            LOGGER.info("Received finish status %s", status_code)
+            save_due_snapshot()
+            if status_code == 202:
+                LOGGER.info("No pending rollup request, trying again")
+            else:
+                if RECORD_PATH:
+                    record_request(rollup_request)
+                handler = handlers[rollup_request["request_type"]]
+                # outputs are posted by the event loop while the handler keeps working in a thread
+                finish["status"] = await asyncio.to_thread(handler, rollup_request["data"])
+    finally:
+        await pipeline.close()
+
+if __name__ == "__main__":
+    if SNAPSHOT_PATH:
+        restore_snapshot()
+    if ASYNC_LOOP:
+        import asyncio
+        asyncio.run(main_async())
     else:
-        rollup_request = response.json()
-        data = rollup_request["data"]
-        handler = handlers[rollup_request["request_type"]]
-        finish["status"] = handler(rollup_request["data"])
\ No newline at end of file
+        main()
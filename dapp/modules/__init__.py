@@ -1,6 +1,14 @@
 from modules.convertions import Convertions
 from modules.eth_abi_ext import decode_packed
-from modules.inputs import Inputs
-from modules.outputs import Voucher, Notice, Report
+from modules.inputs import Inputs, TraceLevel, Erc20Deposit, EtherDeposit, FinishAuction
+from modules.outputs import Voucher, Notice, Report, OutputPipeline, AsyncOutputPipeline
 from modules.log import Logger
-from modules.models import Auction, Bid, AuctionState
\ No newline at end of file
+from modules.models import Auction, Bid, BidStore, AuctionState
+from modules.order_book import OrderBook
+from modules.registry import AuctionRegistry
+from modules.metrics import Metrics, METRICS
+from modules.read_model import ReadModel
+from modules.admission import Rejected, RejectionReports
+from modules.clearing import Clearing, ClearingEngine, PayAsBid, UniformPrice
+from modules.settlement import SettlementPlan
+from modules.workers import EncodingPool
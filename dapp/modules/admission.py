@@ -0,0 +1,74 @@
+from typing import Dict, List, Optional
+from modules.metrics import METRICS
+
+# distinct reasons kept while reports are suppressed, the rest are counted as "other"
+MAX_SUPPRESSED_REASONS = 16
+
+class Rejected(ValueError):
+    """
+    An input that failed validation. It is an expected outcome: the input is
+    rejected and the reason reported, without logging a traceback.
+    """
+
+class RejectionReports:
+    """
+    Turns the rejections of each advance into at most one report, and rate
+    limits those reports to limit per window seconds of input time. Once the
+    limit is hit a rejection only costs a counter increment; the suppressed
+    reasons are summed up in the first report of the next window. Windows are
+    measured on input timestamps, so replays report the same way.
+    """
+
+    def __init__(self, limit: int = 10, window: int = 60) -> None:
+        if limit < 0 or window <= 0:
+            raise ValueError("limit must be non-negative and window positive")
+        # limit 0 reports every rejection
+        self._limit = limit
+        self._window = window
+        self._window_start: Optional[int] = None
+        self._reported = 0
+        self._pending: List[str] = []
+        self._suppressed: Dict[str, int] = {}
+        self._suppressed_since: Optional[int] = None
+
+    @property
+    def suppressed(self) -> int:
+        return sum(self._suppressed.values())
+
+    def reject(self, reason: str) -> None:
+        """Records a rejection of the current advance."""
+        self._pending.append(reason)
+        METRICS.count("rejections")
+
+    def flush(self, timestamp: int) -> Optional[str]:
+        """Ends the advance at timestamp and returns the text of its report, if one is due."""
+        pending, self._pending = self._pending, []
+        if self._window_start is None or timestamp - self._window_start >= self._window:
+            self._window_start = timestamp
+            self._reported = 0
+        if not pending and not self._suppressed:
+            return None
+        if self._limit and self._reported >= self._limit:
+            if pending:
+                self._suppress(pending, timestamp)
+            return None
+
+        # under the limit with suppressed reasons left means a new window has started
+        self._reported += 1
+        parts = pending + ([self._summary()] if self._suppressed else [])
+        self._suppressed = {}
+        self._suppressed_since = None
+        return "; ".join(parts)
+
+    def _suppress(self, reasons: List[str], timestamp: int) -> None:
+        if self._suppressed_since is None:
+            self._suppressed_since = timestamp
+        for reason in reasons:
+            if reason not in self._suppressed and len(self._suppressed) >= MAX_SUPPRESSED_REASONS:
+                reason = "other"
+            self._suppressed[reason] = self._suppressed.get(reason, 0) + 1
+        METRICS.count("rejections.suppressed", len(reasons))
+
+    def _summary(self) -> str:
+        reasons = sorted(self._suppressed.items(), key=lambda item: (-item[1], item[0]))
+        return f"{self.suppressed} more rejections since timestamp {self._suppressed_since}: " + ", ".join(f"{reason} x{count}" for reason, count in reasons)
@@ -0,0 +1,156 @@
+from fractions import Fraction
+from typing import Dict, List, NamedTuple, Optional
+from modules.pricing import exact_price
+from modules.settlement import ETHER
+
+PAY_AS_BID = "pay-as-bid"
+UNIFORM = "uniform"
+
+class Clearing(NamedTuple):
+    """
+    Allocation of an order book. Bids ranked above the marginal price are
+    filled in full, the bids at the marginal price share what is left of the
+    supply pro rata, and the bids below it are refunded.
+    """
+    # price per token: what every winner pays in uniform mode, the lowest winning price in pay-as-bid
+    price: Optional[Fraction]
+    # tokens allocated to each bid at the marginal price, by store index, possibly 0
+    marginal_fills: Dict[int, int]
+    # bids allocated at least one token
+    winners: int
+    sold: int
+    proceeds: int
+
+def pro_rata(amount: int, quantities: List[int]) -> List[int]:
+    """
+    Splits amount, less than sum(quantities), in proportion to quantities.
+    Shares are floored and the units left over go one each to the largest
+    remainders, the earlier quantity first on equal remainders.
+    """
+    total = sum(quantities)
+    shares = []
+    remainders = []
+    for position, quantity in enumerate(quantities):
+        share, remainder = divmod(amount * quantity, total)
+        shares.append(share)
+        remainders.append((-remainder, position))
+    remainders.sort()
+    for _, position in remainders[:amount - sum(shares)]:
+        shares[position] += 1
+    return shares
+
+class ClearingEngine:
+    """
+    Clears an OrderBook in O(n) at most. The allocation is the same for
+    every engine: the book already keeps the bids ranked above the marginal
+    price on its filled side, so only the bids at the marginal price are
+    looked at to share the rest of the supply. Engines differ in the price
+    winners pay, see payment.
+    """
+    name = ""
+
+    def clear(self, book, reserve_price_per_token: int) -> Clearing:
+        store = book.store
+        ether_amounts = store.ether_amounts
+        erc20_amounts = store.erc20_amounts
+        filled_tier, unfilled_tier = book.marginal_tier()
+        tier = sorted(filled_tier + unfilled_tier)
+        # what the filled side leaves over, plus what its bids at the marginal price would have taken
+        available = book.remaining_amount + sum(erc20_amounts[index] for index in filled_tier)
+        fills = pro_rata(available, [erc20_amounts[index] for index in tier]) if available else [0] * len(tier)
+        marginal_fills = dict(zip(tier, fills))
+        sold = book.supply if unfilled_tier else book.filled_amount
+        winners = book.filled_count - len(filled_tier) + sum(1 for fill in fills if fill)
+
+        marginal_price = exact_price(ether_amounts[tier[0]], erc20_amounts[tier[0]]) if tier else None
+        price = self.price(book, marginal_price if available else None, marginal_price, reserve_price_per_token)
+        return Clearing(price, marginal_fills, winners, sold, self.proceeds(book, marginal_fills, price, filled_tier))
+
+    def price(self, book, lowest_winning: Optional[Fraction], highest_losing: Optional[Fraction], reserve_price_per_token: int) -> Optional[Fraction]:
+        raise NotImplementedError
+
+    def payment(self, ether_amount: int, erc20_amount: int, fill: int, price: Optional[Fraction]) -> int:
+        """Ether paid for fill of the erc20_amount tokens a bid of ether_amount asked for, never more than ether_amount."""
+        raise NotImplementedError
+
+    def proceeds(self, book, marginal_fills: Dict[int, int], price: Optional[Fraction], filled_tier: List[int]) -> int:
+        """Ether paid by all the winners, which goes to the seller."""
+        store = book.store
+        ether_amounts = store.ether_amounts
+        erc20_amounts = store.erc20_amounts
+        total = 0
+        for index in book.filled_indexes:
+            total += self.payment(ether_amounts[index], erc20_amounts[index], marginal_fills.get(index, erc20_amounts[index]), price)
+        filled_tier = set(filled_tier)
+        for index, fill in marginal_fills.items():
+            if index not in filled_tier:
+                total += self.payment(ether_amounts[index], erc20_amounts[index], fill, price)
+        return total
+
+    def settlement(self, book, clearing: Clearing, plan, token_address: str) -> None:
+        """
+        Credits plan, a SettlementPlan, with the tokens won and the ether not
+        paid by every bid, filled side first, in heap order.
+        """
+        store = book.store
+        ether_amounts = store.ether_amounts
+        erc20_amounts = store.erc20_amounts
+        sender_ids = store.sender_ids
+        senders = store.senders
+        marginal_fills = clearing.marginal_fills
+        price = clearing.price
+        for filled, indexes in ((True, book.filled_indexes), (False, book.unfilled_indexes)):
+            for index in indexes:
+                ether_amount = ether_amounts[index]
+                erc20_amount = erc20_amounts[index]
+                fill = marginal_fills.get(index, erc20_amount if filled else 0)
+                sender = senders[sender_ids[index]]
+                plan.credit(token_address, sender, fill)
+                plan.credit(ETHER, sender, ether_amount - self.payment(ether_amount, erc20_amount, fill, price))
+
+class PayAsBid(ClearingEngine):
+    """Discriminatory pricing: every winner pays its own price for the tokens it gets."""
+    name = PAY_AS_BID
+
+    def price(self, book, lowest_winning, highest_losing, reserve_price_per_token):
+        # with no token left for the marginal bids, the worst filled bid sets the price
+        return lowest_winning if lowest_winning is not None else book.clearing_price
+
+    def payment(self, ether_amount, erc20_amount, fill, price):
+        return ether_amount * fill // erc20_amount
+
+    def proceeds(self, book, marginal_fills, price, filled_tier):
+        # the book keeps the filled side's ether up to date, only the marginal bids need a pass
+        store = book.store
+        ether_amounts = store.ether_amounts
+        erc20_amounts = store.erc20_amounts
+        total = book.filled_ether - sum(ether_amounts[index] for index in filled_tier)
+        for index, fill in marginal_fills.items():
+            total += self.payment(ether_amounts[index], erc20_amounts[index], fill, price)
+        return total
+
+class UniformPrice(ClearingEngine):
+    """
+    Uniform (second) price: every winner pays the price of the best bid
+    left with unfilled tokens, or the reserve price when every bid is filled.
+    """
+    name = UNIFORM
+
+    def price(self, book, lowest_winning, highest_losing, reserve_price_per_token):
+        if highest_losing is not None:
+            return highest_losing
+        return Fraction(reserve_price_per_token) if len(book) else None
+
+    def payment(self, ether_amount, erc20_amount, fill, price):
+        return fill * price.numerator // price.denominator
+
+    def proceeds(self, book, marginal_fills, price, filled_tier):
+        if price is not None and price.denominator == 1:
+            # whole price: no payment is floored, so the total is the tokens sold times the price
+            erc20_amounts = book.store.erc20_amounts
+            sold = book.filled_amount - sum(erc20_amounts[index] for index in filled_tier) + sum(marginal_fills.values())
+            return sold * price.numerator
+        # each winner's payment is floored on its own, so they are summed one by one
+        return super().proceeds(book, marginal_fills, price, filled_tier)
+
+ENGINES = {engine.name: engine for engine in (PayAsBid(), UniformPrice())}
@@ -1,43 +1,57 @@
-from eth_abi.codec import (
-    ABICodec,
-)
-from eth_abi.registry import (
-    registry_packed,
-    BaseEquals
-)
-from eth_abi.decoding import (
-    BooleanDecoder,
-    AddressDecoder,
-    UnsignedIntegerDecoder
-)
-
-
-
-class PackedBooleanDecoder(BooleanDecoder):
-    data_byte_size = 1 
-
-class PackedAddressDecoder(AddressDecoder):
-    data_byte_size = 20
-
-registry_packed.register_decoder(
-    BaseEquals("bool"),
-    PackedBooleanDecoder,
-    label="bool",
-)
-
-registry_packed.register_decoder(
-    BaseEquals("address"),
-    PackedAddressDecoder,
-    label='address'
-)
-
-registry_packed.register_decoder(
-    BaseEquals("uint"),
-    UnsignedIntegerDecoder,
-    label="uint"
-)
-
-
-default_codec_packed = ABICodec(registry_packed)
-
-decode_packed = default_codec_packed.decode
\ No newline at end of file
+from typing import Any, Iterable, Tuple
+
+# eth_abi is only needed by decode_packed, which the input decoders no longer
+# use, so the packed codec is built on first call instead of at import
+_codec_packed = None
+
+
+def _build_codec_packed():
+    from eth_abi.codec import (
+        ABICodec,
+    )
+    from eth_abi.registry import (
+        registry_packed,
+        BaseEquals
+    )
+    from eth_abi.decoding import (
+        BooleanDecoder,
+        AddressDecoder,
+        UnsignedIntegerDecoder
+    )
+
+    class PackedBooleanDecoder(BooleanDecoder):
+        data_byte_size = 1
+
+    class PackedAddressDecoder(AddressDecoder):
+        data_byte_size = 20
+
+    # a copy, so eth_abi's own packed registry is left untouched
+    registry = registry_packed.copy()
+
+    registry.register_decoder(
+        BaseEquals("bool"),
+        PackedBooleanDecoder,
+        label="bool",
+    )
+
+    registry.register_decoder(
+        BaseEquals("address"),
+        PackedAddressDecoder,
+        label='address'
+    )
+
+    registry.register_decoder(
+        BaseEquals("uint"),
+        UnsignedIntegerDecoder,
+        label="uint"
+    )
+
+    return ABICodec(registry)
+
+
+def decode_packed(types: Iterable[str], data: bytes) -> Tuple[Any, ...]:
+    """Decodes tightly packed (abi.encodePacked) data, eth_abi.decode style."""
+    global _codec_packed
+    if _codec_packed is None:
+        _codec_packed = _build_codec_packed()
+    return _codec_packed.decode(types, data)
@@ -0,0 +1,35 @@
+from typing import Dict
+
+NEW_AUCTION = "newAuction(uint256,uint256,uint256)"
+NEW_BID = "newBid(uint256)"
+NEW_BID_BY_ID = "newBid(uint256,uint256)"
+FINISH_AUCTION = "finishAuction()"
+FINISH_AUCTION_BY_ID = "finishAuction(uint256)"
+ERC20_TRANSFER = "transfer(address,uint256)"
+ETHER_WITHDRAWAL = "withdrawEther(address,uint256)"
+
+SUPPORTED_SIGNATURES = (NEW_AUCTION, NEW_BID, NEW_BID_BY_ID, FINISH_AUCTION, FINISH_AUCTION_BY_ID, ERC20_TRANSFER, ETHER_WITHDRAWAL)
+
+# keccak(signature)[:4], precomputed so startup does not load a keccak backend;
+# verify_selectors() recomputes them
+SELECTORS: Dict[str, bytes] = {
+    NEW_AUCTION: bytes.fromhex("290f000a"),
+    NEW_BID: bytes.fromhex("e2543d1c"),
+    NEW_BID_BY_ID: bytes.fromhex("6993e2e6"),
+    FINISH_AUCTION: bytes.fromhex("430ca46f"),
+    FINISH_AUCTION_BY_ID: bytes.fromhex("cf266ed0"),
+    ERC20_TRANSFER: bytes.fromhex("a9059cbb"),
+    ETHER_WITHDRAWAL: bytes.fromhex("522f6815"),
+}
+HEX_SELECTORS: Dict[str, str] = {signature: "0x" + selector.hex() for signature, selector in SELECTORS.items()}
+SIGNATURES: Dict[bytes, str] = {selector: signature for signature, selector in SELECTORS.items()}
+
+
+def verify_selectors() -> None:
+    """Checks the precomputed selectors against keccak, raising ValueError on a mismatch."""
+    from eth_hash.auto import keccak
+
+    for signature in SUPPORTED_SIGNATURES:
+        expected = keccak(signature.encode())[:4]
+        if SELECTORS[signature] != expected:
+            raise ValueError(f"Selector of {signature} is 0x{SELECTORS[signature].hex()}, expected 0x{expected.hex()}")
@@ -1,59 +1,167 @@
+from enum import IntEnum
+from typing import NamedTuple, Optional, Tuple
+from modules.admission import Rejected
 from modules.log import Logger
+from modules.function_selectors import SELECTORS, NEW_AUCTION, NEW_BID, NEW_BID_BY_ID, FINISH_AUCTION_BY_ID
 from modules.outputs import Report
-from modules.eth_abi_ext import decode_packed
 from modules.convertions import Convertions as convert
 
 LOGGER = Logger(level="INFO", name=__name__).logger
 
+class Erc20Deposit(NamedTuple):
+    depositor: str
+    token_address: str
+    amount: int
+    function_signature: str
+    sender: str
+    duration: int
+    reserve_price_per_token: int
+
+class EtherDeposit(NamedTuple):
+    depositor: str
+    amount: int
+    function_signature: str
+    sender: str
+    erc20_interested_amount: int
+    auction_id: Optional[int] = None
+
+class FinishAuction(NamedTuple):
+    function_signature: str
+    auction_id: Optional[int] = None
+
+# ERC20Portal payload: bool ret | address token | address depositor | uint256 amount | bytes4 selector | address sender | uint256 duration | uint256 reserve price
+ERC20_DEPOSIT_SIZE = 1 + 20 + 20 + 32 + 4 + 20 + 32 + 32
+# EtherPortal payload: address depositor | uint256 amount | bytes4 selector | address sender | [uint256 auction id] | uint256 erc20 interested amount
+ETHER_DEPOSIT_SIZE = 20 + 32 + 4 + 20 + 32
+ETHER_DEPOSIT_BY_ID_SIZE = ETHER_DEPOSIT_SIZE + 32
+# Forest Reserve payload: bytes4 selector | [uint256 auction id]
+FINISH_AUCTION_SIZE = 4
+FINISH_AUCTION_BY_ID_SIZE = FINISH_AUCTION_SIZE + 32
+
+NEW_AUCTION_SELECTOR = SELECTORS[NEW_AUCTION]
+NEW_BID_SELECTOR = SELECTORS[NEW_BID]
+NEW_BID_BY_ID_SELECTOR = SELECTORS[NEW_BID_BY_ID]
+FINISH_AUCTION_BY_ID_SELECTOR = SELECTORS[FINISH_AUCTION_BY_ID]
+
+def _check_size(binary, size: int, name: str) -> memoryview:
+    view = memoryview(binary)
+    if len(view) < size:
+        raise Rejected(f"Invalid {name} payload: expected at least {size} bytes, got {len(view)}")
+    return view
+
+def _check_selector(view: memoryview, offset: int, selectors: Tuple[bytes, ...], name: str) -> None:
+    # a payload of the right size can still be another layout, an erc20 deposit is long enough to pass for an ether one
+    if view[offset:offset + 4] not in selectors:
+        raise Rejected(f"Invalid {name} payload: unexpected selector 0x{view[offset:offset + 4].hex()}")
+
+def peek_bid(binary) -> Tuple[int, int, Optional[int]]:
+    """
+    Reads the ether amount, erc20 interested amount and auction id of an
+    EtherPortal bid, checking its size but building none of its addresses.
+    """
+    view = _check_size(binary, ETHER_DEPOSIT_SIZE, "ether deposit")
+    amount = int.from_bytes(view[20:52], "big")
+    if view[52:56] == NEW_BID_BY_ID_SELECTOR:
+        view = _check_size(view, ETHER_DEPOSIT_BY_ID_SIZE, "ether deposit")
+        return amount, int.from_bytes(view[108:140], "big"), int.from_bytes(view[76:108], "big")
+    return amount, int.from_bytes(view[76:108], "big"), None
+
+def parse_erc20_deposit(binary) -> Erc20Deposit:
+    """Decodes an ERC20Portal payload in place, without going through the ABI codec."""
+    view = _check_size(binary, ERC20_DEPOSIT_SIZE, "erc20 deposit")
+    _check_selector(view, 73, (NEW_AUCTION_SELECTOR,), "erc20 deposit")
+    return Erc20Deposit(
+        depositor="0x" + view[21:41].hex(),
+        token_address="0x" + view[1:21].hex(),
+        amount=int.from_bytes(view[41:73], "big"),
+        function_signature="0x" + view[73:77].hex(),
+        sender="0x" + view[77:97].hex(),
+        duration=int.from_bytes(view[97:129], "big"),
+        reserve_price_per_token=int.from_bytes(view[129:161], "big"),
+    )
+
+def parse_ether_deposit(binary) -> EtherDeposit:
+    """Decodes an EtherPortal payload in place, without going through the ABI codec."""
+    view = _check_size(binary, ETHER_DEPOSIT_SIZE, "ether deposit")
+    _check_selector(view, 52, (NEW_BID_SELECTOR, NEW_BID_BY_ID_SELECTOR), "ether deposit")
+    if view[52:56] == NEW_BID_BY_ID_SELECTOR:
+        view = _check_size(view, ETHER_DEPOSIT_BY_ID_SIZE, "ether deposit")
+        return EtherDeposit(
+            depositor="0x" + view[:20].hex(),
+            amount=int.from_bytes(view[20:52], "big"),
+            function_signature="0x" + view[52:56].hex(),
+            sender="0x" + view[56:76].hex(),
+            erc20_interested_amount=int.from_bytes(view[108:140], "big"),
+            auction_id=int.from_bytes(view[76:108], "big"),
+        )
+    return EtherDeposit(
+        depositor="0x" + view[:20].hex(),
+        amount=int.from_bytes(view[20:52], "big"),
+        function_signature="0x" + view[52:56].hex(),
+        sender="0x" + view[56:76].hex(),
+        erc20_interested_amount=int.from_bytes(view[76:108], "big"),
+    )
+
+def parse_finish_auction(binary) -> FinishAuction:
+    view = _check_size(binary, FINISH_AUCTION_SIZE, "finish auction")
+    if view[:4] == FINISH_AUCTION_BY_ID_SELECTOR:
+        view = _check_size(view, FINISH_AUCTION_BY_ID_SIZE, "finish auction")
+        return FinishAuction(function_signature="0x" + view[:4].hex(), auction_id=int.from_bytes(view[4:36], "big"))
+    return FinishAuction(function_signature="0x" + view[:4].hex())
+
+class TraceLevel(IntEnum):
+    OFF = 0
+    LOG = 1
+    REPORT = 2
+
 class Inputs(Report):
+    """
+    Portal payload decoders. Tracing of decoded inputs is an opt-in debug
+    channel: LOG writes them to the logger, REPORT also emits a report, and
+    only one in every trace_sample_every inputs is traced.
+    """
+    trace_level = TraceLevel.OFF
+    trace_sample_every = 1
+    _traced_inputs = 0
 
     def __init__(rollup_server):
         Report.__init__(rollup_server=rollup_server)
 
     @classmethod
-    def decode_erc20_deposit(cls, binary):
-        ret = binary[:1]
-        token_address = binary[1:21]
-        depositor = binary[21:41]
-        amount = int.from_bytes(binary[41:73], "big")
-        function_signature = binary[73:77]
-        data = decode_packed(['address', 'uint256', 'uint256'], binary[77:])
-        erc20_deposit = {
-            "depositor": convert.binary2hex(depositor),
-            "token_address": convert.binary2hex(token_address),
-            "amount": amount,
-            "function_signature": convert.binary2hex(function_signature),
-            "sender": data[0],
-            "duration": data[1],
-            "reserve_price_per_token": data[2]
-        }
-        cls.send({"payload": convert.str2hex(f"Decode new erc20 deposit {erc20_deposit}")})
-        LOGGER.info(f'erc20_deposit: {erc20_deposit}')
+    def configure_trace(cls, level: TraceLevel = TraceLevel.OFF, sample_every: int = 1) -> None:
+        if sample_every < 1:
+            raise ValueError("sample_every must be at least 1")
+        cls.trace_level = level
+        cls.trace_sample_every = sample_every
+        cls._traced_inputs = 0
+
+    @classmethod
+    def _trace(cls, name: str, decoded) -> None:
+        # counter based sampling keeps traces deterministic across replays
+        cls._traced_inputs += 1
+        if cls._traced_inputs % cls.trace_sample_every:
+            return
+        LOGGER.info("Decode %s %s", name, decoded)
+        if cls.trace_level >= TraceLevel.REPORT:
+            cls.send({"payload": convert.str2hex(f"Decode {name} {decoded}")})
+
+    @classmethod
+    def decode_erc20_deposit(cls, binary) -> Erc20Deposit:
+        erc20_deposit = parse_erc20_deposit(binary)
+        if cls.trace_level:
+            cls._trace("new erc20 deposit", erc20_deposit)
         return erc20_deposit
 
     @classmethod
-    def decode_ether_deposit(cls, binary):
-        depositor = binary[:20]
-        amount = int.from_bytes(binary[20:52], "big")
-        function_signature = binary[52:56]
-        data = decode_packed(['address', 'uint256'],binary[56:])
-        ether_deposit = {
-            "depositor": convert.binary2hex(depositor),
-            "amount": amount,
-            "function_signature": convert.binary2hex(function_signature),
-            "sender": data[0],
-            "erc20_interested_amount": data[1]
-        }
-        cls.send({"payload": convert.str2hex(f"Decode new ether deposit {ether_deposit}")})
-        LOGGER.info(ether_deposit)
+    def decode_ether_deposit(cls, binary) -> EtherDeposit:
+        ether_deposit = parse_ether_deposit(binary)
+        if cls.trace_level:
+            cls._trace("new ether deposit", ether_deposit)
         return ether_deposit
 
     @classmethod
-    def decode_finish_auction(cls, binary):
-        function_signature = binary[:4]
-        finish_auction = {
-            "function_signature": convert.binary2hex(function_signature),
-        }
-        cls.send({"payload": convert.str2hex(f"Decode finish auction {finish_auction}")})
-        LOGGER.info(finish_auction)
-        return finish_auction
\ No newline at end of file
+    def decode_finish_auction(cls, binary) -> FinishAuction:
+        finish_auction = parse_finish_auction(binary)
+        if cls.trace_level:
+            cls._trace("finish auction", finish_auction)
+        return finish_auction
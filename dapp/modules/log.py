@@ -1,8 +1,10 @@
 import logging
+from os import environ
 
 class Logger:
     logger = None
 
     def __init__(self, level="INFO", name=__name__):
-        logging.basicConfig(level=level)
+        # LOG_LEVEL overrides the level of every module, e.g. WARNING to drop the per-input logs
+        logging.basicConfig(level=environ.get("LOG_LEVEL", level))
         Logger.logger = logging.getLogger(name)
\ No newline at end of file
@@ -0,0 +1,124 @@
+import json
+import os
+from time import perf_counter
+from typing import Callable, Dict, List
+from modules.log import Logger
+
+LOGGER = Logger(level="INFO", name=__name__).logger
+
+# bucket i holds durations below 2**i microseconds, the last one everything above
+HISTOGRAM_BUCKETS = 26
+
+class Histogram:
+    """Log2 histogram of durations in seconds, with microsecond resolution."""
+
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets: List[int] = [0] * HISTOGRAM_BUCKETS
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[min(int(seconds * 1e6).bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+
+    def percentile(self, q: float) -> float:
+        """Upper bound, in seconds, of the bucket holding the q-th quantile."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return min(2 ** i / 1e6, self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "total_ms": round(self.total * 1e3, 3),
+            "avg_ms": round(self.total / self.count * 1e3, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(0.5) * 1e3, 3),
+            "p99_ms": round(self.percentile(0.99) * 1e3, 3),
+            "max_ms": round(self.max * 1e3, 3),
+        }
+
+class Stopwatch:
+    """
+    Times consecutive stages of one request: each lap records the time since
+    the previous one under "<prefix>.<stage>".
+    """
+
+    __slots__ = ("_metrics", "_prefix", "_last")
+
+    def __init__(self, metrics: "Metrics", prefix: str) -> None:
+        self._metrics = metrics
+        self._prefix = prefix
+        self._last = perf_counter()
+
+    def lap(self, stage: str) -> None:
+        now = perf_counter()
+        self._metrics.observe(f"{self._prefix}.{stage}", now - self._last)
+        self._last = now
+
+class Metrics:
+    """
+    Counters and per-stage timing histograms of the dApp loop. Metrics are
+    local to this node and never part of the rollup state, so they can be
+    read through inspect and dumped to a file at any time. Hooks see every
+    stage timing as it is observed, even when metrics are disabled.
+    """
+
+    def __init__(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self._counters: Dict[str, int] = {}
+        self._histograms: Dict[str, Histogram] = {}
+        self._hooks: List[Callable[[str, float], None]] = []
+
+    def count(self, name: str, value: int = 1) -> None:
+        if self.enabled:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def add_hook(self, hook: Callable[[str, float], None]) -> None:
+        """Calls hook(stage, seconds) on every observation, e.g. to profile a replay."""
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[[str, float], None]) -> None:
+        self._hooks.remove(hook)
+
+    def observe(self, stage: str, seconds: float) -> None:
+        for hook in self._hooks:
+            hook(stage, seconds)
+        if self.enabled:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def stopwatch(self, prefix: str) -> Stopwatch:
+        return Stopwatch(self, prefix)
+
+    def reset(self) -> None:
+        self._counters.clear()
+        self._histograms.clear()
+
+    def summary(self) -> dict:
+        return {
+            "counters": dict(sorted(self._counters.items())),
+            "stages": {stage: histogram.summary() for stage, histogram in sorted(self._histograms.items())},
+        }
+
+    def dump(self, path: str) -> None:
+        """Writes the summary as JSON, replacing the previous dump atomically."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.summary(), file, indent=2)
+        os.replace(tmp_path, path)
+
+METRICS = Metrics()
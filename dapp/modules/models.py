@@ -1,11 +1,18 @@
-import math
+from array import array
 from enum import Enum
+from fractions import Fraction
+from modules.clearing import Clearing, ClearingEngine, ENGINES, PAY_AS_BID
 from modules.log import Logger
-from typing import List, Tuple
+from modules.order_book import OrderBook
+from modules.pricing import price_at_least
+from modules.settlement import ETHER, SettlementPlan
+from typing import Dict, List, Optional, Tuple
 
 LOGGER = Logger(level="INFO", name=__name__).logger
 
 class Bid:
+    __slots__ = ("_sender", "_ether_amount", "_erc20_interested_amount")
+
     def __init__(self, ether_amount: int, sender, erc20_interested_amount: int) -> None:
         if any(arg is None for arg in [ether_amount, sender, erc20_interested_amount]):
             raise ValueError("None of the arguments can be None")
@@ -28,15 +35,163 @@ class Bid:
 
     @property
     def price_per_token(self) -> int:
-        return math.floor(self._ether_amount / self._erc20_interested_amount)
+        return self._ether_amount // self._erc20_interested_amount
     
+class IntColumn:
+    """Append-only column of non-negative ints, packed as uint64 until a value does not fit."""
+    __slots__ = ("_values",)
+
+    def __init__(self) -> None:
+        self._values = array("Q")
+
+    @classmethod
+    def from_values(cls, values) -> "IntColumn":
+        column = cls()
+        try:
+            column._values = array("Q", values)
+        except OverflowError:
+            column._values = list(values)
+        return column
+
+    @property
+    def packed(self) -> bool:
+        return isinstance(self._values, array)
+
+    @property
+    def values(self):
+        return self._values
+
+    def append(self, value: int) -> None:
+        try:
+            self._values.append(value)
+        except OverflowError:
+            # uint256 amounts beyond 2**64 fall back to a plain list of ints
+            self._values = list(self._values)
+            self._values.append(value)
+
+    def __getitem__(self, index):
+        return self._values[index]
+
+    def __setitem__(self, index: int, value: int) -> None:
+        try:
+            self._values[index] = value
+        except OverflowError:
+            self._values = list(self._values)
+            self._values[index] = value
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __iter__(self):
+        return iter(self._values)
+
+class BidStore:
+    """
+    Columnar bid storage: parallel amount columns and an interned sender
+    table, with the indexes of each sender's bids kept per sender id.
+    """
+
+    def __init__(self) -> None:
+        self._ether_amounts = IntColumn()
+        self._erc20_amounts = IntColumn()
+        self._sender_ids = array("I")
+        self._senders: List[str] = []
+        self._sender_index: Dict[str, int] = {}
+        # bid indexes of every sender, by sender id
+        self._sender_bids: List[array] = []
+
+    @classmethod
+    def from_columns(cls, ether_amounts: IntColumn, erc20_amounts: IntColumn, sender_ids: array, senders: List[str]) -> "BidStore":
+        if not len(ether_amounts) == len(erc20_amounts) == len(sender_ids):
+            raise ValueError("Bid columns must have the same length")
+        store = cls()
+        store._ether_amounts = ether_amounts
+        store._erc20_amounts = erc20_amounts
+        store._sender_ids = sender_ids
+        store._senders = list(senders)
+        store._sender_index = {sender: sender_id for sender_id, sender in enumerate(store._senders)}
+        store._sender_bids = [array("I") for _ in store._senders]
+        for index, sender_id in enumerate(sender_ids):
+            store._sender_bids[sender_id].append(index)
+        return store
+
+    @property
+    def ether_amounts(self) -> IntColumn:
+        return self._ether_amounts
+
+    @property
+    def erc20_amounts(self) -> IntColumn:
+        return self._erc20_amounts
+
+    @property
+    def sender_ids(self) -> array:
+        return self._sender_ids
+
+    @property
+    def senders(self) -> List[str]:
+        return self._senders
+
+    def __len__(self) -> int:
+        return len(self._sender_ids)
+
+    def sender_id(self, sender: str) -> int:
+        """Interns a sender address and returns its id."""
+        sender_id = self._sender_index.get(sender)
+        if sender_id is None:
+            sender_id = self._sender_index[sender] = len(self._senders)
+            self._senders.append(sender)
+            self._sender_bids.append(array("I"))
+        return sender_id
+
+    def append(self, ether_amount: int, sender: str, erc20_amount: int) -> int:
+        index = len(self._sender_ids)
+        sender_id = self.sender_id(sender)
+        self._ether_amounts.append(ether_amount)
+        self._erc20_amounts.append(erc20_amount)
+        self._sender_ids.append(sender_id)
+        self._sender_bids[sender_id].append(index)
+        return index
+
+    def increase(self, index: int, ether_amount: int, erc20_amount: int) -> None:
+        """Adds to the amounts of the bid at index, used when merging bids into one position."""
+        self._ether_amounts[index] += ether_amount
+        self._erc20_amounts[index] += erc20_amount
+
+    def sender(self, index: int) -> str:
+        return self._senders[self._sender_ids[index]]
+
+    def sender_id_of(self, sender: str) -> Optional[int]:
+        """Id of sender if it placed a bid, without interning it."""
+        return self._sender_index.get(sender)
+
+    def indexes_of(self, sender: str) -> array:
+        """Indexes of the bids placed by sender, in arrival order."""
+        sender_id = self._sender_index.get(sender)
+        if sender_id is None:
+            return array("I")
+        return self._sender_bids[sender_id]
+
+    def bid_count(self, sender: str) -> int:
+        sender_id = self._sender_index.get(sender)
+        return 0 if sender_id is None else len(self._sender_bids[sender_id])
+
+    def bid(self, index: int) -> Bid:
+        """Builds a Bid view of the stored bid at index."""
+        return Bid(self._ether_amounts[index], self._senders[self._sender_ids[index]], self._erc20_amounts[index])
+
 class AuctionState(Enum):
     HAPPENING = 0
     NOT_HAPPENING = 1
 
 class Auction:
-    def __init__(self, sender: str, duration: int, amount: int, token_address: str, reserve_price_per_token: int, timestamp: int) -> None:
-        self._bids: List[Bid] = []
+    # how every auction clears, set from CLEARING_MODE by the dApp
+    clearing_engine: ClearingEngine = ENGINES[PAY_AS_BID]
+
+    def __init__(self, sender: str, duration: int, amount: int, token_address: str, reserve_price_per_token: int, timestamp: int, auction_id: int = 0) -> None:
+        self._auction_id = auction_id
+        self._bids = OrderBook(supply=amount, store=BidStore())
+        # (book version, engine, clearing) of the last clearing() call
+        self._clearing: Optional[Tuple[int, ClearingEngine, Clearing]] = None
         self._sender = sender
         self._duration = duration
         self._amount = amount
@@ -44,6 +199,10 @@ class Auction:
         self._token_address = token_address
         self._reserve_price_per_token = reserve_price_per_token
 
+    @property
+    def auction_id(self) -> int:
+        return self._auction_id
+
     @property
     def sender(self) -> str:
         return self._sender
@@ -69,64 +228,85 @@ class Auction:
         return self._token_address
 
     @property
-    def bids(self) -> List[Bid]:
+    def bids(self) -> OrderBook:
         return self._bids
 
+    def clearing(self) -> Clearing:
+        """Clears the bids placed so far with the clearing engine, once per book version."""
+        engine = self.clearing_engine
+        cached = self._clearing
+        if cached is None or cached[0] != self._bids.version or cached[1] is not engine:
+            cached = self._clearing = (self._bids.version, engine, engine.clear(self._bids, self.reserve_price_per_token))
+        return cached[2]
+
+    @property
+    def clearing_price(self) -> Optional[Fraction]:
+        return self.clearing().price
+
+    @property
+    def filled_bids(self) -> List[Bid]:
+        """Bids allocated at least one token, including the marginal bids that get a pro rata share."""
+        marginal_fills = self.clearing().marginal_fills
+        store = self._bids.store
+        indexes = [index for index in self._bids.filled_indexes if marginal_fills.get(index, 1)]
+        indexes += [index for index in self._bids.unfilled_indexes if marginal_fills.get(index, 0)]
+        return [store.bid(index) for index in indexes]
+
+    @property
+    def remaining_amount(self) -> int:
+        return self.amount - self.clearing().sold
+
+    @property
+    def total_ether(self) -> int:
+        return self.clearing().proceeds
+
+    def clearing_status(self) -> dict:
+        """Returns the allocation as it would be settled now."""
+        clearing = self.clearing()
+        return {
+            "clearing_price": clearing.price,
+            "filled_bids": clearing.winners,
+            "total_bids": len(self._bids),
+            "filled_amount": clearing.sold,
+            "remaining_amount": self.amount - clearing.sold,
+            "total_ether": clearing.proceeds,
+        }
+
+    @property
+    def deadline(self) -> int:
+        return self.timestamp_init + self.duration
+
     def remaining_time(self, timestamp):
         """Calculates and returns the remaining time for the auction."""
-        return self.timestamp_init + self.duration - timestamp
+        return self.deadline - timestamp
     
-    def add_bid(self, bid: Bid) -> bool:
-        """Adds a bid to the auction if it meets the minimum price criteria."""
-        if bid.price_per_token >= self.reserve_price_per_token:
-            self.bids.append(bid)
-            LOGGER.info(f"Added bid from {bid.sender} to auction with {bid.ether_amount} wei and {bid.erc20_interested_amount} tokens")
+    def add_bid(self, bid: Bid, merge: bool = False) -> bool:
+        """Adds a bid to the auction if it meets the minimum price criteria, merging it into an earlier same-price bid of its sender if asked to."""
+        if price_at_least(bid.ether_amount, bid.erc20_interested_amount, self.reserve_price_per_token):
+            self.bids.add(bid.ether_amount, bid.sender, bid.erc20_interested_amount, merge=merge)
+            LOGGER.info("Added bid from %s to auction with %s wei and %s tokens", bid.sender, bid.ether_amount, bid.erc20_interested_amount)
             return True
         else:
             return False
 
-    def finish(self, timestamp: int) -> Tuple[List[Bid], List[Bid], int, str, int]:
-        """Finishes the auction and returns the highest bid details if available."""        
+    def bid_count(self, sender: str) -> int:
+        """Number of positions sender holds in the auction."""
+        return self.bids.store.bid_count(sender)
+
+    def finish(self, timestamp: int, plan: SettlementPlan) -> None:
+        """
+        Finishes the auction, crediting plan with the tokens won by every bid,
+        the ether it did not pay (a losing bid, a partly filled one, or any
+        bid below its own price in uniform mode), the seller's proceeds and
+        the tokens left unsold, which go back to the seller.
+        """
         if not self.bids:
             LOGGER.info("No bids were placed during the auction.")
-            return [], [], 0, self.token_address, self.amount
-        
-        total_ether = 0
-        selected_bids = []
-        unselected_bids = []
-        partial_bid_remaining_ether_amount = 0
-        remaining_erc20_amount = self.amount
-        self.bids.sort(key=lambda bid: bid.price_per_token, reverse=True)
-
-        for bid in self.bids:
-            if bid.erc20_interested_amount <= remaining_erc20_amount:
-                total_ether += bid.ether_amount
-                remaining_erc20_amount -= bid.erc20_interested_amount
-                selected_bids.append(bid)
-                LOGGER.info(f"Added bid from {bid.sender} to selected bids with {bid.ether_amount} wei and {bid.erc20_interested_amount} tokens")
-                
-                if remaining_erc20_amount <= 0:
-                    unselected_bids.extend(self.bids[len(selected_bids):])
-                    LOGGER.info(f"Finished auction with {len(selected_bids)} bids selected and {len(unselected_bids)} bids unselected")
-                    break
-            else:
-                partial_acceptance_rate = math.floor(remaining_erc20_amount / bid.erc20_interested_amount)
-                total_ether += math.floor(bid.ether_amount * partial_acceptance_rate)
-                partial_bid_remaining_ether_amount -= bid.ether_amount - math.floor(bid.erc20_interested_amount * partial_acceptance_rate)
-                remaining_erc20_amount -= math.floor(bid.erc20_interested_amount * partial_acceptance_rate)
-                
-                partial_bid = bid.__class__(ether_amount=math.floor(bid.ether_amount * partial_acceptance_rate), sender=bid.sender, erc20_interested_amount=math.floor(bid.erc20_interested_amount * partial_acceptance_rate))
-                selected_bids.append(partial_bid)
-                LOGGER.info(f"Create partial bid from {bid.sender} with {partial_bid.ether_amount} wei and {partial_bid.erc20_interested_amount} tokens")
-
-                if partial_acceptance_rate < 1:
-                    unaccepted_bid = bid.__class__(ether_amount=partial_bid_remaining_ether_amount, sender=bid.sender, erc20_interested_amount=math.floor(bid.erc20_interested_amount * (1 - partial_acceptance_rate)))
-                    unselected_bids.append(unaccepted_bid)
-                    LOGGER.info(f"Create unaccepted part of patial bid from {bid.sender} with {unaccepted_bid.ether_amount} wei and {unaccepted_bid.erc20_interested_amount} tokens")
-                
-                unselected_bids.extend(self.bids[len(selected_bids):])
-                LOGGER.info(f"Finished auction with {len(selected_bids)} bids selected and {len(unselected_bids)} bids unselected")
-                break
-        return selected_bids, unselected_bids, total_ether, self.token_address, remaining_erc20_amount,  self.sender
-
+            plan.credit(self.token_address, self.sender, self.amount)
+            return
 
+        clearing = self.clearing()
+        LOGGER.info("Finished auction with %s of %s bids winning tokens at %s per token (%s)", clearing.winners, len(self.bids), clearing.price, self.clearing_engine.name)
+        self.clearing_engine.settlement(self.bids, clearing, plan, self.token_address)
+        plan.credit(ETHER, self.sender, clearing.proceeds)
+        plan.credit(self.token_address, self.sender, self.amount - clearing.sold)
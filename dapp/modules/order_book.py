@@ -0,0 +1,247 @@
+import heapq
+from fractions import Fraction
+from math import gcd
+from typing import Dict, Iterator, List, Optional, Tuple
+from modules.pricing import price_key, price_key_shift, exact_price
+
+def _top_ties(heap: List[tuple], key) -> Iterator:
+    """Yields the second item of the heap entries whose first item is key, when key is the smallest one, without popping."""
+    # entries equal to the root form a subtree hanging from it
+    stack = [0] if heap and heap[0][0] == key else []
+    while stack:
+        position = stack.pop()
+        yield heap[position][1]
+        for child in (2 * position + 1, 2 * position + 2):
+            if child < len(heap) and heap[child][0] == key:
+                stack.append(child)
+
+def _position_key(sender_id: int, ether_amount: int, erc20_amount: int) -> Tuple[int, int, int]:
+    """Sender id and price per token as a reduced fraction: equal for every bid of the sender at exactly the same price."""
+    divisor = gcd(ether_amount, erc20_amount)
+    return sender_id, ether_amount // divisor, erc20_amount // divisor
+
+class OrderBook:
+    """
+    Price-indexed book of bids for a fixed token supply.
+
+    Bids are ranked by exact price per token (highest first, see
+    modules.pricing.price_key) with FIFO tie-breaks. The book is split in two heaps: the filled side holds the
+    longest prefix of ranked bids that fits the supply, the unfilled side
+    holds everything else. The best unfilled bid is the marginal bid, and
+    modules.clearing shares what the filled side leaves of the supply among
+    the bids at its price.
+
+    Bid data lives in a columnar store; the heaps only hold price keys and
+    store indexes, and bids are handed out as views built on demand.
+
+    With merge, a bid at exactly the price of an earlier bid of the same
+    sender is added to that position, which keeps its place in the ranking.
+    Positions are found in O(1) through an index keyed on sender and
+    reduced price, built on the first merging add.
+    """
+
+    def __init__(self, supply: int, store) -> None:
+        self._supply = supply
+        self._store = store
+        # min-heap, worst filled bid on top: (price key, -index)
+        self._filled: List[tuple] = []
+        # max-heap, best unfilled bid on top: (-price key, index)
+        self._unfilled: List[tuple] = []
+        self._filled_amount = 0
+        self._filled_ether = 0
+        self._key_shift = price_key_shift(supply)
+        # bumped on every change, so results derived from the book can be cached
+        self._version = 0
+        # (sender id, reduced price) -> earliest position at that price; None until a merge needs it
+        self._positions: Optional[Dict[Tuple[int, int, int], int]] = None
+
+    @property
+    def store(self):
+        return self._store
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @property
+    def supply(self) -> int:
+        return self._supply
+
+    @property
+    def filled_amount(self) -> int:
+        return self._filled_amount
+
+    @property
+    def filled_ether(self) -> int:
+        return self._filled_ether
+
+    @property
+    def filled_count(self) -> int:
+        return len(self._filled)
+
+    @property
+    def remaining_amount(self) -> int:
+        return self._supply - self._filled_amount
+
+    @property
+    def filled_indexes(self) -> List[int]:
+        """Store indexes of the bids on the filled side at the current state, in heap order."""
+        return [-entry[1] for entry in self._filled]
+
+    @property
+    def unfilled_indexes(self) -> List[int]:
+        """Store indexes of the bids on the unfilled side at the current state, in heap order."""
+        return [entry[1] for entry in self._unfilled]
+
+    @property
+    def filled(self) -> List:
+        return [self._store.bid(index) for index in self.filled_indexes]
+
+    @property
+    def unfilled(self) -> List:
+        return [self._store.bid(index) for index in self.unfilled_indexes]
+
+    @property
+    def marginal(self):
+        """Best ranked bid that does not fit the remaining supply."""
+        return self._store.bid(self._unfilled[0][1]) if self._unfilled else None
+
+    @property
+    def clearing_price(self) -> Optional[Fraction]:
+        """Lowest price per token among the filled bids."""
+        if not self._filled:
+            return None
+        index = -self._filled[0][1]
+        return exact_price(self._store.ether_amounts[index], self._store.erc20_amounts[index])
+
+    def top(self, n: int) -> List[int]:
+        """Store indexes of the n best ranked bids, best first."""
+        # every filled bid ranks above every unfilled one
+        best = [-neg_index for _, neg_index in heapq.nlargest(n, self._filled)]
+        if len(best) < n:
+            best += [index for _, index in heapq.nsmallest(n - len(best), self._unfilled)]
+        return best
+
+    def __len__(self) -> int:
+        return len(self._filled) + len(self._unfilled)
+
+    def __iter__(self) -> Iterator:
+        yield from self.iter_filled()
+        yield from self.iter_unfilled()
+
+    def iter_filled(self) -> Iterator:
+        """Yields the filled bids in heap order, building one view at a time instead of a list."""
+        store = self._store
+        for _, neg_index in self._filled:
+            yield store.bid(-neg_index)
+
+    def iter_unfilled(self) -> Iterator:
+        """Yields the unfilled bids in heap order, building one view at a time instead of a list."""
+        store = self._store
+        for _, index in self._unfilled:
+            yield store.bid(index)
+
+    def add(self, ether_amount: int, sender: str, erc20_amount: int, merge: bool = False) -> int:
+        """Stores a bid, ranks it and moves the bids that no longer fit to the unfilled side."""
+        self._version += 1
+        if merge:
+            index = self.same_price_position(sender, ether_amount, erc20_amount)
+            if index is not None:
+                self._merge(index, ether_amount, erc20_amount)
+                return index
+
+        index = self._store.append(ether_amount, sender, erc20_amount)
+        if self._positions is not None:
+            self._positions.setdefault(_position_key(self._store.sender_ids[index], ether_amount, erc20_amount), index)
+        if erc20_amount.bit_length() * 2 > self._key_shift:
+            self._rekey(price_key_shift(erc20_amount))
+        price = price_key(ether_amount, erc20_amount, self._key_shift)
+
+        if self._unfilled and price <= -self._unfilled[0][0]:
+            heapq.heappush(self._unfilled, (-price, index))
+            return index
+
+        heapq.heappush(self._filled, (price, -index))
+        self._filled_amount += erc20_amount
+        self._filled_ether += ether_amount
+        self._evict()
+        return index
+
+    def _evict(self) -> None:
+        """Moves the worst filled bids to the unfilled side until the filled ones fit the supply."""
+        ether_amounts = self._store.ether_amounts
+        erc20_amounts = self._store.erc20_amounts
+        while self._filled_amount > self._supply:
+            price, neg_index = heapq.heappop(self._filled)
+            self._filled_amount -= erc20_amounts[-neg_index]
+            self._filled_ether -= ether_amounts[-neg_index]
+            heapq.heappush(self._unfilled, (-price, -neg_index))
+
+    def same_price_position(self, sender: str, ether_amount: int, erc20_amount: int) -> Optional[int]:
+        """Store index of the earliest bid of sender at exactly this price per token, the position a merging add goes to."""
+        sender_id = self._store.sender_id_of(sender)
+        if sender_id is None:
+            return None
+        if self._positions is None:
+            self._index_positions()
+        return self._positions.get(_position_key(sender_id, ether_amount, erc20_amount))
+
+    def _index_positions(self) -> None:
+        store = self._store
+        ether_amounts = store.ether_amounts
+        erc20_amounts = store.erc20_amounts
+        positions = {}
+        # in arrival order, so the earliest bid at a price is kept
+        for index, sender_id in enumerate(store.sender_ids):
+            positions.setdefault(_position_key(sender_id, ether_amounts[index], erc20_amounts[index]), index)
+        self._positions = positions
+
+    def _merge(self, index: int, ether_amount: int, erc20_amount: int) -> None:
+        # the price is unchanged, so the position keeps its key and its place in both heaps
+        store = self._store
+        price = price_key(store.ether_amounts[index], store.erc20_amounts[index], self._key_shift)
+        filled = bool(self._filled) and (price, -index) >= self._filled[0]
+        store.increase(index, ether_amount, erc20_amount)
+        new_erc20_amount = store.erc20_amounts[index]
+        if new_erc20_amount.bit_length() * 2 > self._key_shift:
+            self._rekey(price_key_shift(new_erc20_amount))
+        if filled:
+            self._filled_amount += erc20_amount
+            self._filled_ether += ether_amount
+            self._evict()
+
+    def marginal_tier(self) -> Tuple[List[int], List[int]]:
+        """
+        Store indexes of the bids at the marginal price, the price of the best
+        unfilled bid, on the filled and on the unfilled side. Both are empty
+        when every bid is filled.
+        """
+        if not self._unfilled:
+            return [], []
+        key = -self._unfilled[0][0]
+        return [-neg_index for neg_index in _top_ties(self._filled, key)], list(_top_ties(self._unfilled, -key))
+
+    def restore(self, store, filled_indexes: List[int], unfilled_indexes: List[int]) -> None:
+        """Rebuilds the book over store from the index order of both sides, as saved from filled_indexes and unfilled_indexes."""
+        if len(filled_indexes) + len(unfilled_indexes) != len(store):
+            raise ValueError("Every stored bid must be on exactly one side of the book")
+        ether_amounts = store.ether_amounts
+        erc20_amounts = store.erc20_amounts
+        self._store = store
+        self._version += 1
+        self._positions = None
+        self._filled_amount = sum(erc20_amounts[index] for index in filled_indexes)
+        self._filled_ether = sum(ether_amounts[index] for index in filled_indexes)
+        self._filled = [(0, -index) for index in filled_indexes]
+        self._unfilled = [(0, index) for index in unfilled_indexes]
+        self._rekey(price_key_shift(max(max(erc20_amounts, default=0), self._supply)))
+        heapq.heapify(self._filled)
+        heapq.heapify(self._unfilled)
+
+    def _rekey(self, shift: int) -> None:
+        """Recomputes every price key with a wider shift; the order is unchanged so both heaps stay valid."""
+        ether_amounts = self._store.ether_amounts
+        erc20_amounts = self._store.erc20_amounts
+        self._filled = [(price_key(ether_amounts[-neg_index], erc20_amounts[-neg_index], shift), neg_index) for _, neg_index in self._filled]
+        self._unfilled = [(-price_key(ether_amounts[index], erc20_amounts[index], shift), index) for _, index in self._unfilled]
+        self._key_shift = shift
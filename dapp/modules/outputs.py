@@ -1,56 +1,277 @@
-import web3
-import requests
-from math import floor
-from eth_abi import encode
+import logging
+from time import perf_counter
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
 from modules.log import Logger
-from modules.convertions import Convertions as convert
+from modules.metrics import METRICS
+from modules.function_selectors import SELECTORS, ERC20_TRANSFER, ETHER_WITHDRAWAL
+from modules.voucher_encoder import VoucherEncoder
+
+if TYPE_CHECKING:
+    # only named in annotations; the pipelines import them on first use
+    import asyncio
+    import aiohttp
+    import requests
 
 LOGGER = Logger(level="INFO", name=__name__).logger
 
+class BasePipeline:
+    """Keeps the rollup server address and per-endpoint request statistics."""
+
+    def __init__(self, rollup_server) -> None:
+        self._rollup_server = rollup_server
+        self._stats: Dict[str, dict] = {}
+
+    @property
+    def rollup_server(self):
+        return self._rollup_server
+
+    def stats(self) -> Dict[str, dict]:
+        """Returns the number of requests, failures and latencies per endpoint."""
+        return {
+            endpoint: dict(stat, avg_latency=stat["total_latency"] / stat["requests"] if stat["requests"] else 0.0)
+            for endpoint, stat in self._stats.items()
+        }
+
+    def _record(self, endpoint: str, latency: float, failed: bool) -> None:
+        stat = self._stats.setdefault(endpoint, {"requests": 0, "failures": 0, "total_latency": 0.0, "max_latency": 0.0})
+        stat["requests"] += 1
+        stat["failures"] += int(failed)
+        stat["total_latency"] += latency
+        stat["max_latency"] = max(stat["max_latency"], latency)
+        METRICS.observe(f"post.{endpoint}", latency)
+
+
+class OutputPipeline(BasePipeline):
+    """
+    Queues the outputs of the current rollup request and posts them, in order,
+    over a single keep-alive session right before the next /finish. The queue
+    is flushed early once it holds chunk_size outputs, so a request that
+    streams many outputs never keeps more than one chunk in memory.
+    """
+
+    def __init__(self, rollup_server, buffered: bool = True, chunk_size: int = 256) -> None:
+        super().__init__(rollup_server)
+        self._buffered = buffered
+        self._chunk_size = chunk_size
+        # requests is imported with the session, on the first post
+        self._session = None
+        self._queue: List[Tuple[str, dict]] = []
+
+    @property
+    def session(self) -> "requests.Session":
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+        return self._session
+
+    @property
+    def pending(self) -> int:
+        return len(self._queue)
+
+    def enqueue(self, endpoint: str, json_data: dict) -> None:
+        self._queue.append((endpoint, json_data))
+        if not self._buffered or len(self._queue) >= self._chunk_size:
+            self.flush()
+
+    def post(self, endpoint: str, json_data: dict) -> Optional["requests.Response"]:
+        import requests
+
+        start = perf_counter()
+        failed = True
+        try:
+            response = self.session.post(f"{self._rollup_server}/{endpoint}", json=json_data)
+            failed = response.status_code >= 400
+            LOGGER.info("/%s: Received response status %s body %s", endpoint, response.status_code, response.content)
+            return response
+        except requests.exceptions.RequestException as e:
+            LOGGER.info(f"Failed to send request to /{endpoint}: {e}")
+            return None
+        finally:
+            self._record(endpoint, perf_counter() - start, failed)
+
+    def flush(self) -> int:
+        """Posts every queued output in order and returns how many were sent."""
+        queue, self._queue = self._queue, []
+        for endpoint, json_data in queue:
+            self.post(endpoint, json_data)
+        return len(queue)
+
+    def finish(self, json_data: dict) -> Tuple[int, Optional[dict]]:
+        """Flushes the queued outputs, posts /finish on the same connection and returns its status and body."""
+        flushed = self.flush()
+        if flushed and LOGGER.isEnabledFor(logging.INFO):
+            LOGGER.info("Flushed %s outputs, stats %s", flushed, self.stats())
+        start = perf_counter()
+        response = self.session.post(f"{self._rollup_server}/finish", json=json_data)
+        METRICS.observe("finish_wait", perf_counter() - start)
+        return response.status_code, response.json() if response.status_code == 200 else None
+
+
+class AsyncOutputPipeline(BasePipeline):
+    """
+    Asyncio counterpart of OutputPipeline. Outputs are posted while the
+    handler keeps running in a worker thread, so posting overlaps with
+    settlement work and different endpoints overlap with each other.
+
+    Each endpoint has a bounded queue drained by a single sender. The
+    rollup server numbers vouchers and notices in the order their requests
+    arrive, so an endpoint's outputs must be posted one after the other for
+    replays to produce the same indexes; several senders per endpoint would
+    reorder them. A full queue blocks the handler thread in enqueue, which
+    keeps memory bounded on large settlements. enqueue must therefore be
+    called from a thread other than the event loop's. asyncio and aiohttp
+    are only imported once the pipeline starts.
+    """
+
+    def __init__(self, rollup_server, queue_size: int = 256) -> None:
+        super().__init__(rollup_server)
+        self._queue_size = queue_size
+        self._loop: Optional["asyncio.AbstractEventLoop"] = None
+        self._session: Optional["aiohttp.ClientSession"] = None
+        self._queues: Dict[str, "asyncio.Queue"] = {}
+        self._senders: Dict[str, "asyncio.Task"] = {}
+        self._posted = 0
+
+    @property
+    def pending(self) -> int:
+        return sum(queue.qsize() for queue in self._queues.values())
+
+    async def start(self) -> None:
+        import asyncio
+        import aiohttp
+
+        self._loop = asyncio.get_running_loop()
+        self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(keepalive_timeout=60))
+
+    async def close(self) -> None:
+        import asyncio
+
+        await self.flush()
+        for sender in self._senders.values():
+            sender.cancel()
+        await asyncio.gather(*self._senders.values(), return_exceptions=True)
+        self._senders.clear()
+        await self._session.close()
+
+    def enqueue(self, endpoint: str, json_data: dict) -> None:
+        import asyncio
+
+        # blocks while the endpoint's queue is full
+        asyncio.run_coroutine_threadsafe(self._put(endpoint, json_data), self._loop).result()
+
+    async def _put(self, endpoint: str, json_data: dict) -> None:
+        import asyncio
+
+        queue = self._queues.get(endpoint)
+        if queue is None:
+            queue = self._queues[endpoint] = asyncio.Queue(maxsize=self._queue_size)
+            self._senders[endpoint] = self._loop.create_task(self._send(endpoint, queue))
+        await queue.put(json_data)
+
+    async def _send(self, endpoint: str, queue: "asyncio.Queue") -> None:
+        while True:
+            json_data = await queue.get()
+            try:
+                await self.post(endpoint, json_data)
+                self._posted += 1
+            finally:
+                queue.task_done()
+
+    async def post(self, endpoint: str, json_data: dict) -> Optional[int]:
+        import asyncio
+        import aiohttp
+
+        start = perf_counter()
+        failed = True
+        try:
+            async with self._session.post(f"{self._rollup_server}/{endpoint}", json=json_data) as response:
+                content = await response.read()
+                failed = response.status >= 400
+                LOGGER.info("/%s: Received response status %s body %s", endpoint, response.status, content)
+                return response.status
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            LOGGER.info(f"Failed to send request to /{endpoint}: {e}")
+            return None
+        finally:
+            self._record(endpoint, perf_counter() - start, failed)
+
+    async def flush(self) -> int:
+        """Waits until every enqueued output has been posted and returns how many were posted since the last flush."""
+        import asyncio
+
+        await asyncio.gather(*(queue.join() for queue in self._queues.values()))
+        posted, self._posted = self._posted, 0
+        return posted
+
+    async def finish(self, json_data: dict) -> Tuple[int, Optional[dict]]:
+        """Drains the queued outputs, posts /finish and returns its status and body."""
+        if await self.flush() and LOGGER.isEnabledFor(logging.INFO):
+            LOGGER.info("Flushed outputs, stats %s", self.stats())
+        start = perf_counter()
+        async with self._session.post(f"{self._rollup_server}/finish", json=json_data) as response:
+            METRICS.observe("finish_wait", perf_counter() - start)
+            return response.status, await response.json() if response.status == 200 else None
+
+
 class Base:
-    rollup_server = None
+    pipeline: BasePipeline = None
 
     def __init__(self, rollup_server=None):
         Base.rollup_server = rollup_server
+        if Base.pipeline is None or Base.pipeline.rollup_server != rollup_server:
+            Base.pipeline = OutputPipeline(rollup_server)
 
     @property
     def rollup_server(self):
         return Base.rollup_server
 
+    @staticmethod
+    def use_pipeline(pipeline: BasePipeline) -> None:
+        Base.pipeline = pipeline
+
     @classmethod
     def send_request(cls, endpoint, json_data):
-        try:
-            response = requests.post(f"{cls.rollup_server}/{endpoint}", json=json_data)
-            LOGGER.info(f"/{endpoint}: Received response status {response.status_code} body {response.content}")  
-        except requests.exceptions.RequestException as e:
-            LOGGER.info(f"Failed to send request to /{endpoint}: {e}") 
+        METRICS.count(f"outputs.{endpoint}")
+        cls.pipeline.enqueue(endpoint, json_data)
 
 class Voucher(Base):
     def __init__(self, rollup_server = None):
         super().__init__(rollup_server=rollup_server)
 
-    ERC20_TRANSFER_FUNCTION_SELECTOR = convert.hex2binary(web3.Web3().keccak(b'transfer(address,uint256)')[:4].hex())
-    ETHER_WITHDRAWAL_FUNCTION_SELECTOR = convert.hex2binary(web3.Web3().keccak(b'withdrawEther(address,uint256)')[:4].hex())
+    ERC20_TRANSFER_FUNCTION_SELECTOR = SELECTORS[ERC20_TRANSFER]
+    ETHER_WITHDRAWAL_FUNCTION_SELECTOR = SELECTORS[ETHER_WITHDRAWAL]
+    ERC20_TRANSFER_ENCODER = VoucherEncoder(ERC20_TRANSFER_FUNCTION_SELECTOR)
+    ETHER_WITHDRAWAL_ENCODER = VoucherEncoder(ETHER_WITHDRAWAL_FUNCTION_SELECTOR)
 
     @classmethod
     def create_erc20_transfer_voucher(cls, receiver, amount: int, token_address):
-        data = encode(['address', 'uint256'], [receiver, amount])
-        voucher_payload = convert.binary2hex(cls.ERC20_TRANSFER_FUNCTION_SELECTOR + data)
-        voucher = {"destination": token_address, "payload": voucher_payload}
-        Logger.logger.info(f"Created voucher {voucher}")
+        voucher = {"destination": token_address, "payload": cls.ERC20_TRANSFER_ENCODER.encode_hex(receiver, amount)}
+        LOGGER.info("Created voucher %s", voucher)
         return voucher
 
     @classmethod
     def create_ether_voucher(cls, receiver, amount: int, rollup_address):
-        data = encode(['address', 'uint256'], [receiver, amount])
-        voucher_payload = convert.binary2hex(cls.ETHER_WITHDRAWAL_FUNCTION_SELECTOR + data)
-        voucher = {"destination": rollup_address, "payload": voucher_payload}
-        Logger.logger.info(f"Created voucher {voucher}")
+        voucher = {"destination": rollup_address, "payload": cls.ETHER_WITHDRAWAL_ENCODER.encode_hex(receiver, amount)}
+        LOGGER.info("Created voucher %s", voucher)
         return voucher
 
+    @classmethod
+    def create_erc20_transfer_vouchers(cls, transfers: Iterable[Tuple[str, int]], token_address) -> List[dict]:
+        """Batch form of create_erc20_transfer_voucher for (receiver, amount) pairs of the same token."""
+        vouchers = [{"destination": token_address, "payload": payload} for payload in cls.ERC20_TRANSFER_ENCODER.encode_batch_hex(transfers)]
+        LOGGER.info("Created %s erc20 transfer vouchers for %s", len(vouchers), token_address)
+        return vouchers
+
+    @classmethod
+    def create_ether_vouchers(cls, withdrawals: Iterable[Tuple[str, int]], rollup_address) -> List[dict]:
+        """Batch form of create_ether_voucher for (receiver, amount) pairs."""
+        vouchers = [{"destination": rollup_address, "payload": payload} for payload in cls.ETHER_WITHDRAWAL_ENCODER.encode_batch_hex(withdrawals)]
+        LOGGER.info("Created %s ether vouchers", len(vouchers))
+        return vouchers
+
     @classmethod
     def send(cls, json_data: dict):
-        LOGGER.info(f"Sending voucher {json_data}")
+        LOGGER.info("Sending voucher %s", json_data)
         cls.send_request("voucher", json_data)
 
 
@@ -60,7 +281,7 @@ class Notice(Base):
 
     @classmethod
     def send(cls, json_data: dict):
-        LOGGER.info(f"Sending notice {json_data}")
+        LOGGER.info("Sending notice %s", json_data)
         cls.send_request("notice", json_data)
 
 
@@ -70,5 +291,5 @@ class Report(Base):
 
     @classmethod
     def send(cls, json_data: dict):
-        LOGGER.info(f"Sending report {json_data}")
+        LOGGER.info("Sending report %s", json_data)
         cls.send_request("report", json_data)
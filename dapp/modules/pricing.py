@@ -0,0 +1,29 @@
+from fractions import Fraction
+
+# Two distinct ratios a/b and c/d differ by at least 1/(b*d). Once both
+# denominators are below 2**(shift / 2), scaling by 2**shift before the floor
+# division keeps distinct ratios on distinct integers and equal ratios on the
+# same one. uint256 amounts never need more than 512 bits.
+MAX_PRICE_KEY_SHIFT = 512
+
+def price_key_shift(erc20_amount: int) -> int:
+    """Smallest shift that keeps price keys exact for denominators up to erc20_amount."""
+    return min(2 * max(erc20_amount.bit_length(), 1), MAX_PRICE_KEY_SHIFT)
+
+def price_key(ether_amount: int, erc20_amount: int, shift: int = MAX_PRICE_KEY_SHIFT) -> int:
+    """Integer sort key that orders ether/erc20 price ratios exactly, see price_key_shift."""
+    return (ether_amount << shift) // erc20_amount
+
+def compare_prices(ether_a: int, erc20_a: int, ether_b: int, erc20_b: int) -> int:
+    """Returns -1, 0 or 1 as price a is lower, equal or higher than price b, by cross-multiplication."""
+    left = ether_a * erc20_b
+    right = ether_b * erc20_a
+    return (left > right) - (left < right)
+
+def price_at_least(ether_amount: int, erc20_amount: int, price_per_token: int) -> bool:
+    """Checks ether_amount / erc20_amount >= price_per_token without dividing."""
+    return ether_amount >= price_per_token * erc20_amount
+
+def exact_price(ether_amount: int, erc20_amount: int) -> Fraction:
+    """Exact price for display; comparisons should go through price_key or compare_prices."""
+    return Fraction(ether_amount, erc20_amount)
@@ -0,0 +1,169 @@
+import json
+from typing import Callable, Dict, Optional, Tuple
+from modules.convertions import Convertions as convert
+from modules.log import Logger
+from modules.models import Auction, AuctionState
+from modules.registry import AuctionRegistry
+
+LOGGER = Logger(level="INFO", name=__name__).logger
+
+MAX_TOP_BIDS = 100
+
+def _amount(value: int) -> str:
+    # wei and token amounts overflow the safe integers of JSON clients, so they are sent as strings
+    return str(value)
+
+def _price(price) -> Optional[str]:
+    return None if price is None else str(price)
+
+class ReadModel:
+    """
+    JSON views of the auctions served to inspect requests.
+
+    Responses are cached as ready-to-send hex payloads, keyed by query and
+    parameters. The cache belongs to one state version: invalidate() is
+    called after every advance, so polls between advances are a dict lookup.
+
+    Queries are JSON objects with a "query" field:
+        {"query": "status"}
+        {"query": "auctions"}
+        {"query": "auction", "auction_id": 0}
+        {"query": "clearing", "auction_id": 0}
+        {"query": "top_bids", "auction_id": 0, "n": 10}
+        {"query": "bids_by_sender", "auction_id": 0, "sender": "0x..."}
+    auction_id may be left out while a single auction is happening.
+    """
+
+    def __init__(self, max_cached: int = 1024) -> None:
+        self._version = 0
+        self._max_cached = max_cached
+        self._cache: Dict[Tuple, str] = {}
+        self._queries: Dict[str, Callable[[AuctionRegistry, dict], dict]] = {
+            "status": self._status,
+            "auctions": self._auctions,
+            "auction": self._auction,
+            "clearing": self._clearing,
+            "top_bids": self._top_bids,
+            "bids_by_sender": self._bids_by_sender,
+        }
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def invalidate(self) -> None:
+        """Moves to a new state version, dropping every cached response."""
+        self._version += 1
+        self._cache.clear()
+
+    def query(self, registry: AuctionRegistry, request: dict) -> str:
+        """Returns the hex encoded JSON response to request, from the cache when possible."""
+        name = request.get("query")
+        handler = self._queries.get(name)
+        if handler is None:
+            raise ValueError(f"Unknown query {name}, use one of {', '.join(self._queries)}")
+        key = (name,) + tuple(sorted((k, str(v)) for k, v in request.items() if k != "query"))
+        payload = self._cache.get(key)
+        if payload is None:
+            response = handler(registry, request)
+            response["version"] = self._version
+            payload = convert.str2hex(json.dumps(response, separators=(",", ":")))
+            if len(self._cache) < self._max_cached:
+                self._cache[key] = payload
+        return payload
+
+    @staticmethod
+    def _resolve(registry: AuctionRegistry, request: dict) -> Auction:
+        auction_id = request.get("auction_id")
+        return registry.resolve(None if auction_id is None else int(auction_id))
+
+    @staticmethod
+    def _bid(auction: Auction, index: int, filled: bool, marginal_fills: Dict[int, int]) -> dict:
+        store = auction.bids.store
+        # bids at the marginal price get their pro rata share, the others all or nothing
+        fill = marginal_fills.get(index, store.erc20_amounts[index] if filled else 0)
+        return {
+            "index": index,
+            "sender": store.sender(index),
+            "ether_amount": _amount(store.ether_amounts[index]),
+            "erc20_interested_amount": _amount(store.erc20_amounts[index]),
+            "filled": fill > 0,
+            "filled_amount": _amount(fill),
+        }
+
+    @staticmethod
+    def _summary(auction: Auction) -> dict:
+        return {
+            "auction_id": auction.auction_id,
+            "seller": auction.sender,
+            "token_address": auction.token_address,
+            "amount": _amount(auction.amount),
+            "deadline": auction.deadline,
+            "total_bids": len(auction.bids),
+        }
+
+    def _status(self, registry: AuctionRegistry, request: dict) -> dict:
+        return {
+            "state": (AuctionState.HAPPENING if len(registry) else AuctionState.NOT_HAPPENING).name,
+            "auctions": len(registry),
+            "bids": sum(len(auction.bids) for auction in registry),
+        }
+
+    def _auctions(self, registry: AuctionRegistry, request: dict) -> dict:
+        if "token_address" in request:
+            auctions = registry.by_token(request["token_address"].lower())
+        elif "seller" in request:
+            auctions = registry.by_seller(request["seller"].lower())
+        else:
+            auctions = list(registry)
+        return {"auctions": [self._summary(auction) for auction in auctions]}
+
+    def _auction(self, registry: AuctionRegistry, request: dict) -> dict:
+        auction = self._resolve(registry, request)
+        return dict(
+            self._summary(auction),
+            reserve_price_per_token=_amount(auction.reserve_price_per_token),
+            timestamp_init=auction.timestamp_init,
+            duration=auction.duration,
+            **self._clearing(registry, request),
+        )
+
+    def _clearing(self, registry: AuctionRegistry, request: dict) -> dict:
+        auction = self._resolve(registry, request)
+        status = auction.clearing_status()
+        return {
+            "auction_id": auction.auction_id,
+            "clearing_price": _price(status["clearing_price"]),
+            "filled_bids": status["filled_bids"],
+            "total_bids": status["total_bids"],
+            "filled_amount": _amount(status["filled_amount"]),
+            "remaining_amount": _amount(status["remaining_amount"]),
+            "total_ether": _amount(status["total_ether"]),
+        }
+
+    def _top_bids(self, registry: AuctionRegistry, request: dict) -> dict:
+        auction = self._resolve(registry, request)
+        n = int(request.get("n", 10))
+        if not 0 < n <= MAX_TOP_BIDS:
+            raise ValueError(f"n must be between 1 and {MAX_TOP_BIDS}")
+        filled_count = auction.bids.filled_count
+        marginal_fills = auction.clearing().marginal_fills
+        # top ranks the filled side first, so the first filled_count entries are on it
+        return {
+            "auction_id": auction.auction_id,
+            "bids": [self._bid(auction, index, rank < filled_count, marginal_fills) for rank, index in enumerate(auction.bids.top(n))],
+        }
+
+    def _bids_by_sender(self, registry: AuctionRegistry, request: dict) -> dict:
+        auction = self._resolve(registry, request)
+        sender = request.get("sender")
+        if not sender:
+            raise ValueError("sender is required")
+        indexes = auction.bids.store.indexes_of(sender.lower())
+        filled = set(auction.bids.filled_indexes) if indexes else set()
+        marginal_fills = auction.clearing().marginal_fills if indexes else {}
+        return {
+            "auction_id": auction.auction_id,
+            "sender": sender.lower(),
+            "bids": [self._bid(auction, index, index in filled, marginal_fills) for index in indexes],
+        }
@@ -0,0 +1,100 @@
+import heapq
+from typing import Dict, Iterator, List, Optional
+from modules.log import Logger
+from modules.models import Auction
+
+LOGGER = Logger(level="INFO", name=__name__).logger
+
+class AuctionRegistry:
+    """
+    Live auctions keyed by auction id, with per-token and per-seller indexes.
+    Ids are handed out sequentially so they are the same on every replay.
+    Lookups, creation and removal are O(1) in the number of live auctions.
+
+    Deadlines are kept in a min-heap of (deadline, auction id). Removed
+    auctions leave their entry behind and it is dropped once it expires, so
+    pop_expired only touches auctions whose deadline has passed.
+    """
+
+    def __init__(self, next_id: int = 0) -> None:
+        self._next_id = next_id
+        self._auctions: Dict[int, Auction] = {}
+        # dicts used as insertion-ordered sets of auction ids
+        self._by_token: Dict[str, Dict[int, None]] = {}
+        self._by_seller: Dict[str, Dict[int, None]] = {}
+        self._deadlines: List[tuple] = []
+
+    @property
+    def next_id(self) -> int:
+        return self._next_id
+
+    def __len__(self) -> int:
+        return len(self._auctions)
+
+    def __iter__(self) -> Iterator[Auction]:
+        return iter(self._auctions.values())
+
+    def __contains__(self, auction_id: int) -> bool:
+        return auction_id in self._auctions
+
+    def create(self, sender: str, duration: int, amount: int, token_address: str, reserve_price_per_token: int, timestamp: int) -> Auction:
+        auction = Auction(sender=sender, duration=duration, amount=amount, token_address=token_address, reserve_price_per_token=reserve_price_per_token, timestamp=timestamp, auction_id=self._next_id)
+        self.add(auction)
+        LOGGER.info(f"Created auction {auction.auction_id} from {sender} for {amount} tokens of {token_address}")
+        return auction
+
+    def add(self, auction: Auction) -> None:
+        """Registers an existing auction, e.g. one restored from a snapshot."""
+        if auction.auction_id in self._auctions:
+            raise ValueError(f"Auction {auction.auction_id} already exists")
+        self._auctions[auction.auction_id] = auction
+        self._by_token.setdefault(auction.token_address, {})[auction.auction_id] = None
+        self._by_seller.setdefault(auction.sender, {})[auction.auction_id] = None
+        heapq.heappush(self._deadlines, (auction.deadline, auction.auction_id))
+        self._next_id = max(self._next_id, auction.auction_id + 1)
+
+    def get(self, auction_id: int) -> Optional[Auction]:
+        return self._auctions.get(auction_id)
+
+    def resolve(self, auction_id: Optional[int]) -> Auction:
+        """Returns the auction with auction_id, or the only live auction when no id is given."""
+        if auction_id is None:
+            if not self._auctions:
+                raise ValueError("There is no auction happening")
+            if len(self._auctions) > 1:
+                raise ValueError("An auction id is required when several auctions are happening")
+            return next(iter(self._auctions.values()))
+        auction = self._auctions.get(auction_id)
+        if auction is None:
+            raise ValueError(f"There is no auction {auction_id} happening")
+        return auction
+
+    def remove(self, auction_id: int) -> Auction:
+        auction = self._auctions.pop(auction_id)
+        self._discard(self._by_token, auction.token_address, auction_id)
+        self._discard(self._by_seller, auction.sender, auction_id)
+        return auction
+
+    def pop_expired(self, timestamp: int) -> List[Auction]:
+        """Returns the live auctions whose deadline is at or before timestamp, earliest first, and forgets their deadlines."""
+        expired = []
+        while self._deadlines and self._deadlines[0][0] <= timestamp:
+            _, auction_id = heapq.heappop(self._deadlines)
+            auction = self._auctions.get(auction_id)
+            if auction is not None:
+                expired.append(auction)
+        return expired
+
+    def by_token(self, token_address: str) -> List[Auction]:
+        return [self._auctions[auction_id] for auction_id in self._by_token.get(token_address, ())]
+
+    def by_seller(self, seller: str) -> List[Auction]:
+        return [self._auctions[auction_id] for auction_id in self._by_seller.get(seller, ())]
+
+    @staticmethod
+    def _discard(index: Dict[str, Dict[int, None]], key: str, auction_id: int) -> None:
+        ids = index.get(key)
+        if ids is not None:
+            ids.pop(auction_id, None)
+            if not ids:
+                del index[key]
@@ -0,0 +1,88 @@
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+from modules.outputs import Voucher
+from modules.workers import EncodingPool
+
+# asset key of ether payments; tokens are keyed by their address
+ETHER = "ether"
+
+# rough L1 gas figures, only used to estimate what a plan saves
+# executing one voucher: its transaction and the check of its output proof
+VOUCHER_OVERHEAD_GAS = 50_000
+# the transfer or withdrawal that one payment makes
+PAYMENT_GAS = 35_000
+
+def _encode_chunk(shard: Tuple[str, str, List[Tuple[str, int]]]) -> List[dict]:
+    """Vouchers of (asset, destination, [(receiver, amount), ...]); module level so pool workers can run it."""
+    asset, destination, payments = shard
+    if asset == ETHER:
+        return Voucher.create_ether_vouchers(payments, destination)
+    return Voucher.create_erc20_transfer_vouchers(payments, destination)
+
+class SettlementPlan:
+    """
+    Net amounts owed per (asset, receiver) over every payment of a
+    settlement: token fills, ether refunds and the seller's payout. Each
+    receiver is paid each asset once, whatever number of bids, auctions or
+    roles it was credited for, so the plan emits the fewest vouchers a
+    settlement can take.
+    """
+
+    def __init__(self) -> None:
+        # asset -> receiver -> amount, both in order of first credit
+        self._owed: Dict[str, Dict[str, int]] = {}
+        self.payments = 0
+        self.vouchers_sent = 0
+
+    def credit(self, asset: str, receiver: str, amount: int) -> None:
+        """Adds amount of asset to what receiver is owed; zero amounts are no payment."""
+        if amount < 0:
+            raise ValueError(f"Cannot credit a negative amount {amount} of {asset} to {receiver}")
+        if not amount:
+            return
+        owed = self._owed.get(asset)
+        if owed is None:
+            owed = self._owed[asset] = {}
+        owed[receiver] = owed.get(receiver, 0) + amount
+        self.payments += 1
+
+    def owed(self, asset: str) -> Dict[str, int]:
+        return dict(self._owed.get(asset, {}))
+
+    @property
+    def transfers(self) -> int:
+        """Net (asset, receiver) payments, one voucher each."""
+        return sum(len(owed) for owed in self._owed.values())
+
+    def __bool__(self) -> bool:
+        return bool(self._owed)
+
+    def vouchers(self, rollup_address, chunk_size: int = 256, pool: Optional[EncodingPool] = None) -> Iterator[dict]:
+        """
+        Yields the vouchers paying every net amount, asset by asset: an
+        ether withdrawal or a token transfer per receiver, both made by the
+        dApp itself. Chunks are encoded by pool when one is given, in the
+        same order either way.
+        """
+        # a chunk never mixes assets, the vouchers of an asset share a destination and an encoder
+        shards = []
+        for asset, owed in self._owed.items():
+            destination = rollup_address if asset == ETHER else asset
+            payments = iter(owed.items())
+            while chunk := list(islice(payments, chunk_size)):
+                shards.append((asset, destination, chunk))
+
+        results = pool.map(_encode_chunk, shards, self.transfers) if pool else map(_encode_chunk, shards)
+        for vouchers in results:
+            self.vouchers_sent += len(vouchers)
+            yield from vouchers
+
+    def gas_saved(self) -> int:
+        """Estimated L1 gas the vouchers sent save over one voucher per payment."""
+        unplanned = self.payments * (VOUCHER_OVERHEAD_GAS + PAYMENT_GAS)
+        planned = self.vouchers_sent * VOUCHER_OVERHEAD_GAS + self.transfers * PAYMENT_GAS
+        return unplanned - planned
+
+    def summary(self) -> str:
+        vouchers = "1 voucher" if self.vouchers_sent == 1 else f"{self.vouchers_sent} vouchers"
+        return f"{self.payments} payments netted to {self.transfers} transfers in {vouchers}, about {self.gas_saved()} gas saved"
@@ -0,0 +1,192 @@
+import os
+import sys
+import struct
+from array import array
+from typing import List, NamedTuple, Optional
+from modules.log import Logger
+from modules.models import Auction, BidStore, IntColumn
+from modules.registry import AuctionRegistry
+
+LOGGER = Logger(level="INFO", name=__name__).logger
+
+MAGIC = b"AUCS"
+VERSION = 2
+
+class Snapshot(NamedTuple):
+    input_index: int
+    rollup_address: Optional[str]
+    auctions: AuctionRegistry
+
+class _Writer:
+    """Little-endian binary writer; ints are length-prefixed big-endian so uint256 amounts stay compact."""
+
+    def __init__(self) -> None:
+        self._parts: List[bytes] = []
+
+    def raw(self, value: bytes) -> None:
+        self._parts.append(value)
+
+    def u8(self, value: int) -> None:
+        self._parts.append(struct.pack("<B", value))
+
+    def u32(self, value: int) -> None:
+        self._parts.append(struct.pack("<I", value))
+
+    def int(self, value: int) -> None:
+        raw = value.to_bytes((value.bit_length() + 7) // 8, "big")
+        self.u8(len(raw))
+        self._parts.append(raw)
+
+    def str(self, value: Optional[str]) -> None:
+        if value is None:
+            self.u32(0xFFFFFFFF)
+            return
+        raw = value.encode("utf-8")
+        self.u32(len(raw))
+        self._parts.append(raw)
+
+    def u32_array(self, values) -> None:
+        packed = array("I", values)
+        if sys.byteorder == "big":
+            packed.byteswap()
+        self.u32(len(packed))
+        self._parts.append(packed.tobytes())
+
+    def int_column(self, column: IntColumn) -> None:
+        self.u8(int(column.packed))
+        if column.packed:
+            packed = array("Q", column.values)
+            if sys.byteorder == "big":
+                packed.byteswap()
+            self.u32(len(packed))
+            self._parts.append(packed.tobytes())
+        else:
+            self.u32(len(column))
+            for value in column:
+                self.int(value)
+
+    def getvalue(self) -> bytes:
+        return b"".join(self._parts)
+
+class _Reader:
+    def __init__(self, data) -> None:
+        self._view = memoryview(data)
+        self._offset = 0
+
+    def raw(self, size: int) -> bytes:
+        return bytes(self._take(size))
+
+    def _take(self, size: int) -> memoryview:
+        if self._offset + size > len(self._view):
+            raise ValueError("Truncated snapshot")
+        chunk = self._view[self._offset:self._offset + size]
+        self._offset += size
+        return chunk
+
+    def u8(self) -> int:
+        return self._take(1)[0]
+
+    def u32(self) -> int:
+        return struct.unpack("<I", self._take(4))[0]
+
+    def int(self) -> int:
+        return int.from_bytes(self._take(self.u8()), "big")
+
+    def str(self) -> Optional[str]:
+        size = self.u32()
+        if size == 0xFFFFFFFF:
+            return None
+        return bytes(self._take(size)).decode("utf-8")
+
+    def u32_array(self) -> array:
+        packed = array("I")
+        packed.frombytes(self._take(4 * self.u32()))
+        if sys.byteorder == "big":
+            packed.byteswap()
+        return packed
+
+    def int_column(self) -> IntColumn:
+        if self.u8():
+            packed = array("Q")
+            packed.frombytes(self._take(8 * self.u32()))
+            if sys.byteorder == "big":
+                packed.byteswap()
+            return IntColumn.from_values(packed)
+        return IntColumn.from_values([self.int() for _ in range(self.u32())])
+
+def _dump_auction(writer: _Writer, auction: Auction) -> None:
+    writer.int(auction.auction_id)
+    writer.str(auction.sender)
+    writer.int(auction.duration)
+    writer.int(auction.amount)
+    writer.str(auction.token_address)
+    writer.int(auction.reserve_price_per_token)
+    writer.int(auction.timestamp_init)
+
+    store = auction.bids.store
+    writer.int_column(store.ether_amounts)
+    writer.int_column(store.erc20_amounts)
+    writer.u32_array(store.sender_ids)
+    writer.u32(len(store.senders))
+    for sender in store.senders:
+        writer.str(sender)
+    writer.u32_array(auction.bids.filled_indexes)
+    writer.u32_array(auction.bids.unfilled_indexes)
+
+def _load_auction(reader: _Reader) -> Auction:
+    auction_id = reader.int()
+    auction = Auction(sender=reader.str(), duration=reader.int(), amount=reader.int(), token_address=reader.str(), reserve_price_per_token=reader.int(), timestamp=reader.int(), auction_id=auction_id)
+    ether_amounts = reader.int_column()
+    erc20_amounts = reader.int_column()
+    sender_ids = reader.u32_array()
+    senders = [reader.str() for _ in range(reader.u32())]
+    store = BidStore.from_columns(ether_amounts, erc20_amounts, sender_ids, senders)
+    auction.bids.restore(store, reader.u32_array(), reader.u32_array())
+    return auction
+
+def dumps(snapshot: Snapshot) -> bytes:
+    """Serializes the dApp state into the binary snapshot format."""
+    writer = _Writer()
+    writer.raw(MAGIC)
+    writer.u8(VERSION)
+    writer.int(snapshot.input_index + 1)
+    writer.str(snapshot.rollup_address)
+    writer.int(snapshot.auctions.next_id)
+    writer.u32(len(snapshot.auctions))
+    for auction in snapshot.auctions:
+        _dump_auction(writer, auction)
+    return writer.getvalue()
+
+def loads(data) -> Snapshot:
+    """Rebuilds the dApp state from a binary snapshot without replaying any input."""
+    reader = _Reader(data)
+    if reader.raw(len(MAGIC)) != MAGIC:
+        raise ValueError("Not an auction snapshot")
+    version = reader.u8()
+    if version != VERSION:
+        raise ValueError(f"Unsupported snapshot version {version}")
+    input_index = reader.int() - 1
+    rollup_address = reader.str()
+    auctions = AuctionRegistry(next_id=reader.int())
+    for _ in range(reader.u32()):
+        auctions.add(_load_auction(reader))
+    return Snapshot(input_index, rollup_address, auctions)
+
+def save(path: str, snapshot: Snapshot) -> int:
+    """Writes the snapshot atomically and returns its size in bytes."""
+    data = dumps(snapshot)
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(data)
+    os.replace(temporary_path, path)
+    LOGGER.info(f"Saved snapshot of input {snapshot.input_index} to {path} ({len(data)} bytes)")
+    return len(data)
+
+def load(path: str) -> Optional[Snapshot]:
+    """Reads the snapshot at path, or returns None when there is none yet."""
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as file:
+        snapshot = loads(file.read())
+    LOGGER.info(f"Loaded snapshot of input {snapshot.input_index} from {path}")
+    return snapshot
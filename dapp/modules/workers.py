@@ -0,0 +1,101 @@
+import os
+from collections import deque
+from typing import Callable, Iterator, List
+from modules.log import Logger
+from modules.metrics import METRICS
+
+LOGGER = Logger(level="INFO", name=__name__).logger
+
+class EncodingPool:
+    """
+    Optional process pool for the CPU-bound end of a settlement: encoding
+    voucher payloads and converting them to hex. Meant for host mode, where
+    the dApp runs on a multi-core machine; inside the single-core Cartesi
+    machine it never starts.
+
+    Shards are mapped in submission order and their results yielded in that
+    order, so the outputs are the same, byte for byte and in sequence, as
+    the inline path's. Everything runs inline with fewer than two workers or
+    cores, for maps of fewer than min_items items, and once the pool has
+    failed to start or broken, in which case the shards it did not finish
+    are redone inline. At most two shards per worker are in flight, so a
+    large map does not hold every shard's result until it is consumed.
+
+    Workers come from a forkserver, never a fork of the dApp itself: with
+    ASYNC_LOOP the dApp runs threads, and a forked child can deadlock on a
+    lock one of them held. The forkserver imports the main module once, so
+    the dApp's entry point must stay behind its __main__ guard.
+    """
+
+    def __init__(self, workers: int = 0, min_items: int = 4096) -> None:
+        self._workers = min(workers, os.cpu_count() or 1)
+        self._min_items = min_items
+        self._executor = None
+        self._broken = False
+
+    @property
+    def enabled(self) -> bool:
+        return self._workers > 1 and not self._broken
+
+    def map(self, fn: Callable, shards: List, items: int) -> Iterator:
+        """Yields fn(shard) for every shard, in order; items is the work the shards hold, to skip the pool for small maps."""
+        if not self.enabled or items < self._min_items or len(shards) < 2:
+            return map(fn, shards)
+        executor = self._start()
+        if executor is None:
+            return map(fn, shards)
+        return self._ordered(executor, fn, shards)
+
+    def _start(self):
+        if self._executor is None:
+            try:
+                # concurrent.futures and multiprocessing are only loaded when the pool is used
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                # forkserver: workers are forked from a single-threaded server that loaded the encoders once
+                self._executor = ProcessPoolExecutor(max_workers=self._workers, mp_context=multiprocessing.get_context("forkserver"))
+            except (ImportError, OSError, ValueError, NotImplementedError) as e:
+                LOGGER.warning("Encoding pool of %s workers could not start, encoding inline: %s", self._workers, e)
+                self._broken = True
+                return None
+            LOGGER.info("Started encoding pool of %s workers", self._workers)
+        return self._executor
+
+    def _ordered(self, executor, fn: Callable, shards: List) -> Iterator:
+        from concurrent.futures import BrokenExecutor
+        METRICS.count("workers.shards", len(shards))
+        window = deque()
+        submitted = 0
+        try:
+            for position in range(len(shards)):
+                try:
+                    while submitted < len(shards) and len(window) < 2 * self._workers:
+                        window.append(executor.submit(fn, shards[submitted]))
+                        submitted += 1
+                except (BrokenExecutor, RuntimeError, OSError) as e:
+                    self._fail(e)
+                    yield from map(fn, shards[position:])
+                    return
+                try:
+                    result = window.popleft().result()
+                except (BrokenExecutor, OSError) as e:
+                    # a worker died; fn is deterministic, so an inline rerun gives what it would have
+                    self._fail(e)
+                    yield from map(fn, shards[position:])
+                    return
+                yield result
+        finally:
+            # a consumer that stops early leaves no work queued behind it
+            for future in window:
+                future.cancel()
+
+    def _fail(self, error: Exception) -> None:
+        LOGGER.warning("Encoding pool failed, encoding inline from now on: %s", error)
+        METRICS.count("workers.failures")
+        self._broken = True
+        self.close()
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None